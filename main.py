@@ -1,10 +1,18 @@
 from run import Bot
-from utils import asyncio
+from plugins import SpotifyDownloader
+from utils import asyncio, db, YoutubeResolver, Thumbnails, SpotdlService
 
 
 async def main():
     await Bot.initialize()
-    await Bot.run()
+    try:
+        await Bot.run()
+    finally:
+        await SpotifyDownloader.spotify_account.close()
+        await Thumbnails.close()
+        await SpotdlService.stop()
+        await db.close()
+        YoutubeResolver.shutdown()
 
 
 asyncio.run(main())
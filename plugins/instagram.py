@@ -1,5 +1,5 @@
 from utils import bs4, wget
-from utils import asyncio, re, requests
+from utils import asyncio, re, requests, time, db
 
 
 class Insta:
@@ -88,14 +88,18 @@ class Insta:
     async def download(client, event) -> bool:
         link = Insta.extract_url(event.message.text)
 
+        started = time.monotonic()
         start_message = await event.respond("Processing Your insta link ....")
         try:
             if "ddinstagram.com" in link:
                 raise Exception
             link = link.replace("instagram.com", "ddinstagram.com")
-            return await Insta.download_content(client, event, start_message, link)
+            result = await Insta.download_content(client, event, start_message, link)
         except:
-            await Insta.download_content(client, event, start_message, link)
+            result = await Insta.download_content(client, event, start_message, link)
+        if result:
+            await db.record_event('delivery', 'instagram', user_id=event.sender_id, latency=time.monotonic() - started)
+        return result
 
     @staticmethod
     async def download_reel(client, event, link):
@@ -1,8 +1,9 @@
-from run import Button, Buttons
-from utils import asyncio, re, os, load_dotenv, combinations
-from utils import db, SpotifyException, fast_upload, Any
-from utils import Image, BytesIO, YoutubeDL, lyricsgenius, aiohttp, InputMediaUploadedDocument
-from utils import SpotifyClientCredentials, spotipy, ThreadPoolExecutor, DocumentAttributeAudio
+from run import Button, Buttons, get_user_context
+from utils import asyncio, re, os, time, load_dotenv, run_in_background
+from utils import db, fast_upload, Any, JobLeases, SpotifyCache, YoutubeResolver, Pipeline, MusicCatalog
+from utils import YoutubeDL, lyricsgenius, aiohttp, InputMediaUploadedDocument
+from utils import AsyncSpotify, DocumentAttributeAudio, TelegramMediaCache, SingleFlight, Thumbnails
+from utils import ProgressReporter, ProviderRace, SpotdlService, shutil, tempfile
 
 
 class SpotifyDownloader:
@@ -14,6 +15,10 @@ class SpotifyDownloader:
             cls.SPOTIFY_CLIENT_ID = os.getenv("SPOTIFY_CLIENT_ID")
             cls.SPOTIFY_CLIENT_SECRET = os.getenv("SPOTIFY_CLIENT_SECRET")
             cls.GENIUS_ACCESS_TOKEN = os.getenv("GENIUS_ACCESS_TOKEN")
+            cls.SPOTDL_HEDGE_DELAY = float(os.getenv("SPOTDL_HEDGE_DELAY") or 20)
+            cls.SPOTDL_MAX_CONCURRENCY = int(os.getenv("SPOTDL_MAX_CONCURRENCY") or 4)
+            cls.SPOTDL_QUEUE_TIMEOUT = float(os.getenv("SPOTDL_QUEUE_TIMEOUT") or 300)
+            cls.SPOTDL_JOB_TIMEOUT = float(os.getenv("SPOTDL_JOB_TIMEOUT") or 600)
         except FileNotFoundError:
             print("Failed to Load .env variables")
 
@@ -30,72 +35,219 @@ class SpotifyDownloader:
     def initialize(cls):
         cls._load_dotenv_and_create_folders()
         cls.MAXIMUM_DOWNLOAD_SIZE_MB = 50
-        cls.spotify_account = spotipy.Spotify(client_credentials_manager=
-                                              SpotifyClientCredentials(client_id=cls.SPOTIFY_CLIENT_ID,
-                                                                       client_secret=cls.SPOTIFY_CLIENT_SECRET))
+        cls.playlist_queue_size = 8
+        cls.spotify_account = AsyncSpotify(cls.SPOTIFY_CLIENT_ID, cls.SPOTIFY_CLIENT_SECRET)
+        # Downloads in progress, keyed by media key, so concurrent requests for a track share one download
+        cls.downloads = SingleFlight()
+        # spotdl audio providers, raced against each other and reordered by how often they succeed
+        cls.spotdl_race = ProviderRace(cls.spotdl_approaches, hedge_delay=cls.SPOTDL_HEDGE_DELAY,
+                                       queue_timeout=cls.SPOTDL_QUEUE_TIMEOUT)
+        SpotdlService.configure(cls.spotify_account.client_id, cls.spotify_account.client_secret,
+                                max_concurrency=cls.SPOTDL_MAX_CONCURRENCY,
+                                work_directory=os.path.join(cls.download_directory, ".spotdl-worker"),
+                                job_timeout=cls.SPOTDL_JOB_TIMEOUT)
         cls.genius = lyricsgenius.Genius(cls.GENIUS_ACCESS_TOKEN)
+        Thumbnails.configure(cls.download_icon_directory)
+
+    @staticmethod
+    async def get_track(track_id):
+        return await SpotifyCache.get('track', track_id, SpotifyDownloader.spotify_account.track)
+
+    @staticmethod
+    async def get_album(album_id):
+        return await SpotifyCache.get('album', album_id, SpotifyDownloader.spotify_account.album)
+
+    @staticmethod
+    async def get_artist(artist_id):
+        return await SpotifyCache.get('artist', artist_id, SpotifyDownloader.spotify_account.artist)
+
+    @staticmethod
+    async def get_playlist(playlist_id):
+        # Only the fields the playlist card needs; the tracks are paged separately
+        fields = 'id,name,external_urls,owner(display_name),images,followers(total),public,collaborative,tracks(total)'
+        return await SpotifyCache.get('playlist', playlist_id,
+                                      lambda playlist_id: SpotifyDownloader.spotify_account.playlist(playlist_id,
+                                                                                                     fields=fields))
+
+    @staticmethod
+    async def get_tracks(track_ids):
+        missing = [track_id for track_id in dict.fromkeys(track_ids)
+                   if not SpotifyCache.is_cached('track', track_id)]
+        # The several-tracks endpoint takes up to 50 ids per request
+        for i in range(0, len(missing), 50):
+            for track in (await SpotifyDownloader.spotify_account.tracks(missing[i:i + 50]))['tracks']:
+                if track is not None:
+                    await SpotifyCache.put('track', track['id'], track)
+        return [await SpotifyDownloader.get_track(track_id) for track_id in track_ids]
+
+    @staticmethod
+    async def get_artists(artist_ids):
+        missing = [artist_id for artist_id in dict.fromkeys(artist_ids)
+                   if not SpotifyCache.is_cached('artist', artist_id)]
+        # The several-artists endpoint takes up to 50 ids per request
+        for i in range(0, len(missing), 50):
+            for artist in (await SpotifyDownloader.spotify_account.artists(missing[i:i + 50]))['artists']:
+                if artist is not None:
+                    await SpotifyCache.put('artist', artist['id'], artist)
+        return [await SpotifyDownloader.get_artist(artist_id) for artist_id in artist_ids]
+
+    @staticmethod
+    async def prefetch_artists(artist_ids):
+        try:
+            await SpotifyDownloader.get_artists(artist_ids)
+        except Exception as e:
+            print(f"Failed to prefetch artists: {e}")
+
+    link_pattern = re.compile(
+        r'(?:https?://)?(?:open|play)\.spotify\.com/(?:intl-[a-z]{2}(?:-[a-z]{2})?/)?(?:embed/)?(?:user/[^/\s]+/)?'
+        r'(?P<type>track|playlist|album|artist|show|episode)/(?P<id>[A-Za-z0-9]{22})', re.IGNORECASE)
+    uri_pattern = re.compile(r'spotify:(?:user:[^:\s]+:)?(?P<type>track|playlist|album|artist|show|episode):'
+                             r'(?P<id>[A-Za-z0-9]{22})')
+    short_link_pattern = re.compile(r'(?:https?://)?(?P<host>spotify\.link|spotify\.app\.link)/(?P<code>[A-Za-z0-9]+)')
+    id_pattern = re.compile(r'[A-Za-z0-9]{22}')
 
     @staticmethod
     def is_spotify_link(url):
-        pattern = r'https?://open\.spotify\.com/.*'
+        pattern = r'(?:https?://(?:open\.spotify\.com|play\.spotify\.com|spotify\.link|spotify\.app\.link)/|spotify:)'
         return re.match(pattern, url) is not None
 
     @staticmethod
-    def identify_spotify_link_type(spotify_url) -> str:
-        # Define a list of all primary resource types supported by Spotify
-        resource_types = ['track', 'playlist', 'album', 'artist', 'show', 'episode']
+    def parse_spotify_link(spotify_url):
+        """
+        Returns (type, id) for open.spotify.com URLs (intl- and embed paths included) and spotify: URIs,
+        or None when the link cannot be classified without a network call.
+        """
+        match = SpotifyDownloader.link_pattern.search(spotify_url) or SpotifyDownloader.uri_pattern.search(
+            spotify_url)
+        if match is None:
+            return None
+        return match.group('type').lower(), match.group('id')
 
-        for resource_type in resource_types:
+    short_link_session = None
+
+    @classmethod
+    def _get_short_link_session(cls):
+        if cls.short_link_session is None or cls.short_link_session.closed:
+            cls.short_link_session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=15))
+        return cls.short_link_session
+
+    @staticmethod
+    async def _resolve_short_link(short_url):
+        # spotify.link is a redirect service; the target is either the final URL or embedded in the landing page
+        async with SpotifyDownloader._get_short_link_session().get(short_url) as response:
+            parsed = SpotifyDownloader.parse_spotify_link(str(response.url))
+            if parsed is None:
+                parsed = SpotifyDownloader.parse_spotify_link(await response.text())
+        if parsed is None:
+            return None
+        return {'type': parsed[0], 'id': parsed[1]}
+
+    @staticmethod
+    async def resolve_spotify_link(spotify_url, default_type=None):
+        """
+        Classifies a Spotify reference without touching the Web API.
+        Short links are resolved once and cached; a bare id is taken to be of default_type.
+        """
+        spotify_url = spotify_url.strip()
+        parsed = SpotifyDownloader.parse_spotify_link(spotify_url)
+        if parsed is not None:
+            return parsed
+
+        match = SpotifyDownloader.short_link_pattern.search(spotify_url)
+        if match is not None:
             try:
-                # Dynamically call the appropriate method on the Spotify API client
-                resource = getattr(SpotifyDownloader.spotify_account, resource_type)(spotify_url)
-                return resource_type
-            except (SpotifyException, Exception) as e:
-                # Continue to the next resource type if an exception occurs
-                continue
+                resolved = await SpotifyCache.get('short_link', match.group('code'),
+                                                  lambda code: SpotifyDownloader._resolve_short_link(
+                                                      f"https://{match.group('host')}/{code}"))
+            except Exception as e:
+                print(f"Failed to resolve Spotify short link {spotify_url}: {e}")
+                resolved = None
+            return (resolved['type'], resolved['id']) if resolved else ('none', None)
+
+        if default_type is not None and SpotifyDownloader.id_pattern.fullmatch(spotify_url):
+            return default_type, spotify_url
+        return 'none', None
 
-        # Return 'none' if no resource type matches
-        return 'none'
+    @staticmethod
+    def build_track_link_info(track_info, album=None):
+        """
+        Builds the link_info record of a track from a Spotify track object.
+        album is for simplified track objects, such as album tracks, that do not embed their album.
+        """
+        artists = track_info['artists']
+        album = album or track_info['album']
+        return {
+            'type': "track",
+            'track_name': track_info['name'],
+            'artist_name': ', '.join(artist['name'] for artist in artists),
+            'artist_ids': [artist['id'] for artist in artists],
+            'artist_url': artists[0]['external_urls']['spotify'],
+            'album_name': album['name'].translate(str.maketrans('', '', '()[]')),
+            'album_url': album['external_urls']['spotify'],
+            'release_year': album['release_date'].split('-')[0],
+            'image_url': album['images'][0]['url'],
+            'track_id': track_info['id'],
+            'isrc': track_info['external_ids']['isrc'],
+            'track_url': track_info['external_urls']['spotify'],
+            'youtube_link': None,  # Placeholder, resolved separately
+            'preview_url': track_info.get('preview_url'),
+            'duration_ms': track_info['duration_ms'],
+            'track_number': track_info['track_number'],
+            'is_explicit': track_info['explicit']
+        }
+
+    @staticmethod
+    async def iter_track_link_infos(tracks, album=None):
+        """
+        Turns a stream of track objects into link_info records without a per-track API call.
+        Objects that lack a field are re-fetched through the several-tracks endpoint, 50 ids per request.
+        """
+        incomplete = []
+
+        async def fetch_incomplete():
+            track_ids = [track['id'] for track in incomplete]
+            incomplete.clear()
+            for track_info in await SpotifyDownloader.get_tracks(track_ids):
+                if track_info is None:
+                    continue
+                try:
+                    yield SpotifyDownloader.build_track_link_info(track_info)
+                except (KeyError, IndexError, TypeError, AttributeError) as e:
+                    print(f"Skipping track {track_info.get('id')}: missing {e}")
+
+        async for track in tracks:
+            try:
+                yield SpotifyDownloader.build_track_link_info(track, album)
+                continue
+            except (KeyError, IndexError, TypeError, AttributeError):
+                incomplete.append(track)
+            if len(incomplete) >= 50:
+                async for link_info in fetch_incomplete():
+                    yield link_info
+        if incomplete:
+            async for link_info in fetch_incomplete():
+                yield link_info
 
     @staticmethod
-    async def extract_data_from_spotify_link(event, spotify_url):
+    async def extract_data_from_spotify_link(event, spotify_url, link_type=None, resolve_youtube: bool = True):
 
-        # Identify the type of Spotify link to handle the data extraction accordingly
-        link_type = SpotifyDownloader.identify_spotify_link_type(spotify_url)
+        # Identify the type of Spotify link locally; link_type is the type to assume for a bare id
+        link_type, spotify_id = await SpotifyDownloader.resolve_spotify_link(spotify_url, link_type)
 
         try:
             if link_type == "track":
                 # Extract track information and construct the link_info dictionary
-                track_info = SpotifyDownloader.spotify_account.track(spotify_url)
-                artists = track_info['artists']
-                album = track_info['album']
-                link_info = {
-                    'type': "track",
-                    'track_name': track_info['name'],
-                    'artist_name': ', '.join(artist['name'] for artist in artists),
-                    'artist_ids': [artist['id'] for artist in artists],
-                    'artist_url': artists[0]['external_urls']['spotify'],
-                    'album_name': album['name'].translate(str.maketrans('', '', '()[]')),
-                    'album_url': album['external_urls']['spotify'],
-                    'release_year': album['release_date'].split('-')[0],
-                    'image_url': album['images'][0]['url'],
-                    'track_id': track_info['id'],
-                    'isrc': track_info['external_ids']['isrc'],
-                    'track_url': track_info['external_urls']['spotify'],
-                    'youtube_link': None,  # Placeholder, will be resolved below
-                    'preview_url': track_info.get('preview_url'),
-                    'duration_ms': track_info['duration_ms'],
-                    'track_number': track_info['track_number'],
-                    'is_explicit': track_info['explicit']
-                }
+                track_info = await SpotifyDownloader.get_track(spotify_id)
+                link_info = SpotifyDownloader.build_track_link_info(track_info)
 
                 # Attempt to enhance track info with additional external data (e.g., YouTube link)
-                link_info['youtube_link'] = await SpotifyDownloader.extract_yt_video_info(link_info)
+                if resolve_youtube:
+                    link_info['youtube_link'] = await SpotifyDownloader.extract_yt_video_info(link_info)
                 return link_info
 
             elif link_type == "playlist":
                 # Extract playlist information and compile playlist tracks into a dictionary
-                playlist_info = SpotifyDownloader.spotify_account.playlist(spotify_url)
+                playlist_info = await SpotifyDownloader.get_playlist(spotify_id)
 
                 playlist_info_dict = {
                     'type': 'playlist',
@@ -106,6 +258,7 @@ class SpotifyDownloader:
                     'playlist_image_url': playlist_info['images'][0]['url'] if playlist_info['images'] else None,
                     'playlist_followers': playlist_info['followers']['total'],
                     'playlist_public': playlist_info['public'],
+                    'collaborative': playlist_info.get('collaborative', False),
                     'playlist_tracks_total': playlist_info['tracks']['total'],
                 }
                 return playlist_info_dict
@@ -131,72 +284,10 @@ class SpotifyDownloader:
         if video_url:
             return video_url
 
-        artist_name = spotify_link_info["artist_name"]
-        track_name = spotify_link_info["track_name"]
-        release_year = spotify_link_info["release_year"]
-        track_duration = spotify_link_info.get("duration_ms", 0) / 1000
-        album_name = spotify_link_info.get("album_name", "")
-
-        queries = [
-            f'"{artist_name}" "{track_name}" lyrics {release_year}',
-            f'"{track_name}" by "{artist_name}" {release_year}',
-            f'"{artist_name}" "{track_name}" "{album_name}" {release_year}',
-        ]
-
-        ydl_opts = {
-            'quiet': True,
-            'no_warnings': True,
-            'ignoreerrors': True,
-            'ytsearch': 3,  # Limit the number of search results
-            'skip_download': True,
-            'format': 'bestvideo[ext=mp4]+bestaudio[ext=m4a]/best[ext=mp4]/best',
-            'noplaylist': True,  # Disable playlist processing
-            'nocheckcertificate': True,  # Disable SSL certificate verification
-            'cachedir': False  # Disable caching
-        }
-
-        executor = ThreadPoolExecutor(max_workers=16)  # Use 16 workers for the blocking I/O operation
-        stop_event = asyncio.Event()
-
-        async def search_query(query):
-            def extract_info_blocking():
-                with YoutubeDL(ydl_opts) as ydl:
-                    try:
-                        info = ydl.extract_info(f'ytsearch:{query}', download=False)
-                        entries = info.get('entries', [])
-                        return entries
-                    except Exception:
-                        return []
-
-            entries = await asyncio.get_running_loop().run_in_executor(executor, extract_info_blocking)
-
-            if not stop_event.is_set():
-                for video_info in entries:
-                    video_url = video_info.get('webpage_url')
-                    video_duration = video_info.get('duration', 0)
-
-                    # Compare the video duration with the track duration from Spotify
-                    duration_diff = abs(video_duration - track_duration)
-                    if duration_diff <= 35:
-                        stop_event.set()
-                        return video_url
-
-            return None
-
-        search_tasks = [asyncio.create_task(search_query(query)) for query in queries]
-        search_results = await asyncio.gather(*search_tasks, return_exceptions=True)
-
-        for result in search_results:
-            if isinstance(result, Exception):
-                continue
-            if result is not None:
-                return result
-
-        return None
+        return await YoutubeResolver.find_video_url(spotify_link_info)
 
     @staticmethod
     async def download_and_send_spotify_info(event, is_query: bool = True) -> bool:
-        user_id = event.sender_id
         waiting_message = None
         if is_query:
             waiting_message = await event.respond('⏳')
@@ -206,13 +297,16 @@ class SpotifyDownloader:
             spotify_link = str(event.message.text)
 
         # Ensure the user's data is up-to-date
-        if not await db.get_user_updated_flag(user_id):
+        user_settings = await get_user_context(event)
+        if user_settings is None or not user_settings.is_user_updated:
             await event.respond(
                 "Our bot has been updated. Please restart the bot with the /start command."
             )
             return True
 
-        link_info = await SpotifyDownloader.extract_data_from_spotify_link(event, spotify_url=spotify_link)
+        # Buttons carry bare track ids, while messages carry links
+        link_info = await SpotifyDownloader.extract_data_from_spotify_link(event, spotify_url=spotify_link,
+                                                                           link_type="track" if is_query else None)
         if link_info["type"] == "track":
             await waiting_message.delete() if is_query else None
             return await SpotifyDownloader.send_track_info(event.client, event, link_info)
@@ -224,26 +318,6 @@ class SpotifyDownloader:
                 requested: {link_info["type"]} """)
             return False
 
-    @staticmethod
-    async def fetch_and_save_playlist_image(playlist_id, playlist_image_url):
-        icon_name = f"{playlist_id}.jpeg"
-        icon_path = os.path.join(SpotifyDownloader.download_icon_directory, icon_name)
-
-        try:
-            async with aiohttp.ClientSession() as session:
-                async with session.get(playlist_image_url) as response:
-                    if response.status == 200:
-                        image_data = await response.read()
-                        img = Image.open(BytesIO(image_data))
-                        img.save(icon_path)
-                        return icon_path
-                    else:
-                        print(f"Failed to download playlist image. Status code: {response.status}")
-        except Exception as e:
-            print(f"Error downloading or saving playlist image: {e}")
-
-        return None
-
     @staticmethod
     async def send_playlist_info(client, event, link_info):
         playlist_image_url = link_info.get('playlist_image_url')
@@ -284,7 +358,7 @@ class SpotifyDownloader:
 
         # Handle the playlist image if exists
         if playlist_image_url:
-            icon_path = await SpotifyDownloader.fetch_and_save_playlist_image(playlist_id, playlist_image_url)
+            icon_path = await Thumbnails.get(playlist_image_url)
             if icon_path:
                 sent_message = await client.send_file(
                     event.chat_id,
@@ -302,62 +376,22 @@ class SpotifyDownloader:
 
     @staticmethod
     async def download_icon(link_info):
-        track_name = link_info['track_name']
-        artist_name = link_info['artist_name']
-        image_url = link_info["image_url"]
-
-        icon_name = f"{track_name} - {artist_name}.jpeg".replace("/", " ")
-        icon_path = os.path.join(SpotifyDownloader.download_icon_directory, icon_name)
-
-        if not os.path.isfile(icon_path):
-            try:
-                async with aiohttp.ClientSession() as session:
-                    async with session.get(image_url) as response:
-                        if response.status == 200:
-                            image_data = await response.read()
-                            img = Image.open(BytesIO(image_data))
-                            img.save(icon_path)
-                        else:
-                            print(
-                                f"Failed to download track image for {track_name} - {artist_name}. Status code: {response.status}")
-            except Exception as e:
-                print(f"Failed to download or save track image for {track_name} - {artist_name}: {e}")
-        return icon_path
+        # Tracks of the same album share their cover, so it is fetched and stored once
+        return await Thumbnails.get(link_info["image_url"])
 
     @staticmethod
     async def send_track_info(client, event, link_info):
-        user_id = event.sender_id
-        music_quality = await db.get_user_music_quality(user_id)
-        downloading_core = await db.get_user_downloading_core(user_id)
+        user_settings = await get_user_context(event)
+        music_quality = dict(user_settings.music_quality)
 
-        if downloading_core == "Auto":
-            spotdl = True if (link_info.get('youtube_link') is None) else False
-        else:
-            spotdl = downloading_core == "SpotDL"
-
-        def build_file_path(artist, track_name, quality_info, format, make_dir=False):
-            filename = f"{artist} - {track_name}".replace("/", "")
-            if not spotdl:
-                filename += f"-{quality_info['quality']}"
-            directory = os.path.join(SpotifyDownloader.download_directory, filename)
-            if make_dir and not os.path.exists(directory):
-                os.makedirs(directory)
-            return f"{directory}.{quality_info['format']}"
-
-        def is_track_local(artist_names, track_name):
-            for r in range(1, len(artist_names) + 1):
-                for combination in combinations(artist_names, r):
-                    file_path = build_file_path(", ".join(combination), track_name, music_quality,
-                                                music_quality['format'])
-                    if os.path.isfile(file_path):
-                        return True, file_path
-            return False, None
-
-        artist_names = link_info['artist_name'].split(', ')
-        is_local, file_path = is_track_local(artist_names, link_info['track_name'])
+        is_local = await MusicCatalog.lookup(link_info['track_id'], music_quality['format'],
+                                             music_quality['quality'], link_info.get('isrc')) is not None
 
         icon_path = await SpotifyDownloader.download_icon(link_info)
 
+        # Warm the artist cache so the "Artist Info" button can be answered without API calls
+        run_in_background(SpotifyDownloader.prefetch_artists(link_info['artist_ids']), name='prefetch_artists')
+
         SpotifyInfoButtons = [
             [Button.inline("Download 30s Preview",
                            data=f"spotify/dl/30s_preview/{link_info['preview_url'].split('?cid')[0].replace('https://p.scdn.co/mp3-preview/', '')}")
@@ -381,19 +415,22 @@ class SpotifyDownloader:
             f"**🗓 Release Year:** {link_info['release_year']}\n"
             f"**❗️ Is Local:** {is_local}\n"
             f"**🌐 ISRC:** {link_info['isrc']}\n"
-            f"**🔄 Downloaded:** {await db.get_song_downloads(link_info['track_name'])} times\n\n"
+            f"**🔄 Downloaded:** {await db.get_track_downloads(link_info['track_id'])} times\n\n"
             f"**Image URL:** [Click here]({link_info['image_url']})\n"
             f"**Track id:** {link_info['track_id']}\n"
         )
 
         try:
-            await client.send_file(
-                event.chat_id,
-                icon_path,
-                caption=caption,
-                parse_mode='Markdown',
-                buttons=SpotifyInfoButtons
-            )
+            if icon_path:
+                await client.send_file(
+                    event.chat_id,
+                    icon_path,
+                    caption=caption,
+                    parse_mode='Markdown',
+                    buttons=SpotifyInfoButtons
+                )
+            else:
+                await event.respond(caption, parse_mode='Markdown', buttons=SpotifyInfoButtons)
             return True
         except Exception as Err:
             print(f"Failed to send track info: {Err}")
@@ -401,7 +438,6 @@ class SpotifyDownloader:
 
     @staticmethod
     async def send_local_file(event, file_info, spotify_link_info, is_playlist: bool = False) -> bool:
-        user_id = event.sender_id
         upload_status_message = None
 
         # Unpack file_info for clarity
@@ -427,7 +463,6 @@ class SpotifyDownloader:
 
         except Exception as e:
             # Handle exceptions and provide feedback
-            await db.set_file_processing_flag(user_id, 0)  # Reset file processing flag
             await event.respond(f"Unfortunately, uploading failed.\nReason: {e}") if not is_playlist else None
             return False  # Returning False signifies the operation didn't complete successfully
 
@@ -438,22 +473,18 @@ class SpotifyDownloader:
         if not is_playlist:
             await upload_status_message.delete()
 
-            # Reset file processing flag after completion
-            await db.set_file_processing_flag(user_id, 0)
-
-        await db.add_or_increment_song(spotify_link_info['track_name'])
+        await db.increment_track_downloads(spotify_link_info['track_id'], spotify_link_info.get('isrc'))
         # Indicate successful upload operation
         return True
 
     @staticmethod
     async def _upload_file(event, file_info, spotify_link_info, playlist: bool = False):
 
-        if not os.path.exists(file_info['icon_path']):
-            await SpotifyDownloader.download_icon(spotify_link_info)
-
         # Unpack file_info for clarity
         file_path = file_info['file_path']
         icon_path = file_info['icon_path']
+        if not os.path.exists(icon_path):
+            icon_path = await SpotifyDownloader.download_icon(spotify_link_info)
         video_url = file_info['video_url']
 
         if not playlist:
@@ -467,7 +498,7 @@ class SpotifyDownloader:
             )
 
         uploaded_file = await event.client.upload_file(uploaded_file if not playlist else file_path)
-        uploaded_thumbnail = await event.client.upload_file(icon_path)
+        uploaded_thumbnail = await event.client.upload_file(icon_path) if icon_path else None
 
         audio_attributes = DocumentAttributeAudio(
             duration=0,
@@ -486,166 +517,151 @@ class SpotifyDownloader:
         )
 
         # Send the media to the chat
-        await event.client.send_file(
+        caption = SpotifyDownloader._track_caption(spotify_link_info, video_url)
+        message = await event.client.send_file(
             event.chat_id,
             media,
-            caption=(
-                    f"🎵 **{spotify_link_info['track_name']}** by **{spotify_link_info['artist_name']}**\n\n"
-                    f"▶️ [Listen on Spotify]({spotify_link_info['track_url']})\n"
-                    + (f"🎥 [Watch on YouTube]({video_url})\n" if video_url else "")
-            ),
+            caption=caption,
             supports_streaming=True,
             force_document=False,
             thumb=icon_path
         )
+        if file_info.get('media_key'):
+            await TelegramMediaCache.remember(event.client, file_info['media_key'], message, caption)
 
     @staticmethod
-    async def download_spotdl(event, music_quality, spotify_link_info, quite: bool = False, initial_message=None,
-                              audio_option: str = "piped") -> bool | tuple[bool, Any | None] | tuple[bool, bool]:
-        user_id = event.sender_id
-        command = f'python3 -m spotdl --format {music_quality["format"]} --audio {audio_option} --output "{SpotifyDownloader.download_directory}" --threads {15} "{spotify_link_info["track_url"]}"'
+    def _track_caption(spotify_link_info, video_url=None):
+        return (
+                f"🎵 **{spotify_link_info['track_name']}** by **{spotify_link_info['artist_name']}**\n\n"
+                f"▶️ [Listen on Spotify]({spotify_link_info['track_url']})\n"
+                + (f"🎥 [Watch on YouTube]({video_url})\n" if video_url else "")
+        )
+
+    @staticmethod
+    async def _send_cached_track(event, file_info, spotify_link_info) -> bool:
+        """
+        Re-sends the document of an earlier upload of this track and quality, if the bot has one.
+        """
+        message = await TelegramMediaCache.send(
+            event.client, event.chat_id, file_info['media_key'],
+            caption=SpotifyDownloader._track_caption(spotify_link_info, file_info['video_url']),
+            supports_streaming=True
+        )
+        return message is not None
+
+    spotdl_approaches = {"piped": "Piped", "soundcloud": "SoundCloud", "youtube": "YouTube"}
+
+    @staticmethod
+    async def download_spotdl(music_quality, spotify_link_info, audio_option, output_directory, started, progressed,
+                              reporter) -> str | None:
+        """
+        Downloads a track with a single spotdl audio provider into output_directory.
+        Returns the path of the downloaded file, or None when the provider failed.
+        """
+        approach = SpotifyDownloader.spotdl_approaches[audio_option]
+
+        def on_started():
+            started()
+            reporter.update(f"SpotDL: Downloading...\nApproach: {approach}")
+
+        def on_progress(status, percent):
+            progressed()
+            reporter.update(f"SpotDL: Downloading...\nApproach: {approach}\n\n{status}: {percent}%")
+
         try:
-            # Start the subprocess
-            process = await asyncio.create_subprocess_shell(
-                command,
-                stdout=asyncio.subprocess.PIPE,
-                stderr=asyncio.subprocess.PIPE,
-                stdin=asyncio.subprocess.DEVNULL
-            )
-        except Exception as e:
-            await event.respond(f"Failed to download. Error: {e}")
-            await db.set_file_processing_flag(user_id, 0)
-            return False
+            return await SpotdlService.download(spotify_link_info["track_url"], music_quality["format"],
+                                                audio_option, output_directory, on_progress, on_started)
+        except RuntimeError as e:
+            print(f"SpotDL ({approach}): {e}")
+            return None
+
+    @staticmethod
+    async def _download_with_spotdl(event, music_quality, spotify_link_info, file_path, quite: bool = False) -> bool:
+        """
+        Downloads a track with spotdl into file_path, hedging across the audio providers.
+        Each provider writes into a staging directory of its own, so parallel attempts never share a file.
+        """
+        message = None if quite else await event.reply("SpotDL: Downloading...")
+        reporter = ProgressReporter(message)
+        staging_directory = tempfile.mkdtemp(prefix=".spotdl-", dir=SpotifyDownloader.download_directory)
+
+        async def attempt(audio_option, started, progressed):
+            output_directory = os.path.join(staging_directory, audio_option)
+            os.makedirs(output_directory, exist_ok=True)
+            return await SpotifyDownloader.download_spotdl(music_quality, spotify_link_info, audio_option,
+                                                           output_directory, started, progressed, reporter)
 
-        if initial_message is None and not quite:
-            # Send an initial message to the user with a progress bar
-            initial_message = await event.reply("SpotDL: Downloading...\nApproach: Piped")
-        elif quite:
-            initial_message = None
-
-        # Function to send updates to the user
-        async def send_updates(process, message):
-            while True:
-                # Read a line from stdout
-                line = await process.stdout.readline()
-                line = line.decode().strip()
-
-                print(line)
-
-                if not quite:
-                    if audio_option == "piped":
-                        await message.edit(f"SpotDL: Downloading...\nApproach: Piped\n\n{line}")
-                    elif audio_option == "soundcloud":
-                        await message.edit(f"SpotDL: Downloading...\nApproach: SoundCloud\n\n{line}")
-                    else:
-                        await message.edit(f"SpotDL: Downloading...\nApproach: YouTube\n\n{line}")
-
-                # Check for errors
-                if any(err in line for err in (
-                        "LookupError", "FFmpegError", "JSONDecodeError", "ReadTimeout", "KeyError", "Forbidden",
-                        "AudioProviderError")):
-                    if audio_option == "piped":
-                        if not quite:
-                            await message.edit(
-                                f"SpotDL: Downloading...\nApproach: Piped Failed, Using SoundCloud Approach.\n\n{line}")
-                        return False  # Indicate that an error occurred
-                    elif audio_option == "soundcloud":
-                        if not quite:
-                            await message.edit(
-                                f"SpotDL: Downloading...\nApproach: SoundCloud Failed, Using Youtube Approach.\n\n{line}")
-                        return False
-                    else:
-                        if not quite:
-                            await message.edit(f"SpotDL: Downloading...\nApproach: All Approaches Failed.\n\n{line}")
-                        return False
-                elif not line:
-                    return True
-
-        success = await send_updates(process, initial_message)
-        if not success and audio_option == "piped":
-            if not quite:
-                await initial_message.edit(
-                    f"SpotDL: Downloading...\nApproach: Piped Failed, Using SoundCloud Approach.")
-            return False, initial_message
-        elif not success and audio_option == "soundcloud":
-            if not quite:
-                await initial_message.edit(
-                    f"SpotDL: Downloading...\nApproach: SoundCloud Failed, Using Youtube Approach.")
-            return False, initial_message
-        elif not success and audio_option == "youtube":
-            return False, False
-        # Wait for the process to finish
-        await process.wait()
-        await initial_message.delete() if initial_message else None
-        return True, True
+        try:
+            _, downloaded = await SpotifyDownloader.spotdl_race.run(attempt)
+            if downloaded:
+                os.replace(downloaded, file_path)
+        finally:
+            reporter.close()
+            shutil.rmtree(staging_directory, ignore_errors=True)
+
+        if not downloaded:
+            await reporter.finish("SpotDL: Downloading...\nApproach: All Approaches Failed.")
+            return False
+        if message:
+            await message.delete()
+        return True
 
     @staticmethod
     async def download_YoutubeDL(event, file_info, music_quality, is_playlist: bool = False):
-        user_id = event.sender_id
         video_url = file_info['video_url']
         filename = file_info['file_name']
 
         download_message = None
         if not is_playlist:
-            download_message = await event.respond("Downloading .")
-
-        async def get_file_size(video_url):
-            ydl_opts = {
-                'format': "bestaudio",
-                'default_search': 'ytsearch',
-                'noplaylist': True,
-                "nocheckcertificate": True,
-                "quiet": True,
-                "geo_bypass": True,
-                'get_filesize': True  # Retrieve the file size without downloading
-            }
-
-            with YoutubeDL(ydl_opts) as ydl:
-                info_dict = await asyncio.to_thread(ydl.extract_info, video_url, download=False)
-                file_size = info_dict.get('filesize', None)
-                return file_size
-
-        async def download_audio(video_url, filename, music_quality):
-            ydl_opts = {
-                'format': "bestaudio",
-                'default_search': 'ytsearch',
-                'noplaylist': True,
-                "nocheckcertificate": True,
-                "outtmpl": f"{SpotifyDownloader.download_directory}/{filename}",
-                "quiet": True,
-                "addmetadata": True,
-                "prefer_ffmpeg": False,
-                "geo_bypass": True,
-                "postprocessors": [{'key': 'FFmpegExtractAudio', 'preferredcodec': music_quality['format'],
-                                    'preferredquality': music_quality['quality']}]
-            }
-
-            with YoutubeDL(ydl_opts) as ydl:
-                await download_message.edit("Downloading . . .") if not is_playlist else None
-                await asyncio.to_thread(ydl.extract_info, video_url, download=True)
-
-        async def download_handler():
-            file_size_task = asyncio.create_task(get_file_size(video_url))
-            file_size = await file_size_task
-
-            if file_size and file_size > SpotifyDownloader.MAXIMUM_DOWNLOAD_SIZE_MB * 1024 * 1024:
-                await event.respond("Err: File size is more than 50 MB.\nSkipping download.")
-                await db.set_file_processing_flag(user_id, 0)
-                return False, None  # Skip the download
-
-            if not is_playlist:
-                await download_message.edit("Downloading . .")
-
-            download_task = asyncio.create_task(download_audio(video_url, filename, music_quality))
-            try:
-                await download_task
-                return True, download_message
-            except Exception as ERR:
-                await event.respond(f"Something Went Wrong Processing Your Query.")
-                await db.set_file_processing_flag(user_id, 0)
-                return False, download_message
+            download_message = await event.respond("Downloading ...")
+        reporter = ProgressReporter(download_message)
 
-        return await download_handler()
+        ydl_opts = {
+            'format': "bestaudio",
+            'default_search': 'ytsearch',
+            'noplaylist': True,
+            "nocheckcertificate": True,
+            "outtmpl": f"{SpotifyDownloader.download_directory}/{filename}",
+            "quiet": True,
+            "addmetadata": True,
+            "prefer_ffmpeg": False,
+            "geo_bypass": True,
+            "postprocessors": [{'key': 'FFmpegExtractAudio', 'preferredcodec': music_quality['format'],
+                                'preferredquality': music_quality['quality']}],
+            "progress_hooks": [reporter.ytdlp_progress_hook],
+            "postprocessor_hooks": [reporter.ytdlp_postprocessor_hook]
+        }
+
+        try:
+            downloaded_path = await asyncio.to_thread(SpotifyDownloader._download_within_limit, ydl_opts, video_url)
+        except Exception as ERR:
+            await event.respond(f"Something Went Wrong Processing Your Query.")
+            return False, download_message
+        finally:
+            reporter.close()
+
+        if downloaded_path is None:
+            await event.respond("Err: File size is more than 50 MB.\nSkipping download.")
+            return False, None  # Skip the download
+        return True, download_message
+
+    @staticmethod
+    def _download_within_limit(ydl_opts, video_url):
+        """
+        Downloads video_url unless the selected format is over the size limit, extracting its page only once:
+        the info dict of the size check is handed straight to the download.
+        Returns the path yt-dlp downloaded to, or None when the file is too large. Blocking.
+        """
+        with YoutubeDL(ydl_opts) as ydl:
+            info = ydl.extract_info(video_url, download=False)
+            # A merged selection lists its parts in requested_formats; a single format is merged into info
+            selected_formats = info.get('requested_formats') or [info]
+            file_size = sum(selected.get('filesize') or selected.get('filesize_approx') or 0
+                            for selected in selected_formats)
+            if file_size > SpotifyDownloader.MAXIMUM_DOWNLOAD_SIZE_MB * 1024 * 1024:
+                return None
+            info = ydl.process_ie_result(info, download=True)
+            return ydl.prepare_filename(info)
 
     @staticmethod
     async def download_spotify_file_and_send(event) -> bool:
@@ -660,54 +676,100 @@ class SpotifyDownloader:
         else:
             spotify_link = query_data.split("/")[-1][:-1]
 
-        if await db.get_file_processing_flag(user_id):
+        lease = JobLeases.acquire(user_id)
+        if lease is None:
             await event.respond("Sorry,There is already a file being processed for you.")
             return True
 
-        fetch_message = await event.respond("Fetching information... Please wait.")
-        spotify_link_info = await SpotifyDownloader.extract_data_from_spotify_link(event, spotify_link)
-
-        await db.set_file_processing_flag(user_id, 1)
-        await fetch_message.delete()
+        async with lease:
+            fetch_message = await event.respond("Fetching information... Please wait.")
+            spotify_link_info = await SpotifyDownloader.extract_data_from_spotify_link(
+                event, spotify_link, "playlist" if is_playlist else "track")
+            await fetch_message.delete()
 
-        if spotify_link_info['type'] == "track":
-            return await SpotifyDownloader.download_track(event, spotify_link_info)
-        elif spotify_link_info['type'] == "playlist":
-            return await SpotifyDownloader.download_playlist(event, spotify_link_info,
-                                                             number_of_downloads=query_data.split("/")[-1][:-1])
+            if spotify_link_info['type'] == "track":
+                return await SpotifyDownloader.download_track(event, spotify_link_info)
+            elif spotify_link_info['type'] == "playlist":
+                return await SpotifyDownloader.download_playlist(event, spotify_link_info, lease,
+                                                                 number_of_downloads=query_data.split("/")[-1][:-1])
 
     @staticmethod
-    async def download_track(event, spotify_link_info, is_playlist: bool = False):
-
-        user_id = event.sender_id
-
-        music_quality = await db.get_user_music_quality(user_id)
-        downloading_core = await db.get_user_downloading_core(user_id)
-
+    async def _build_file_info(spotify_link_info, music_quality, downloading_core):
+        """
+        Picks the downloader for a track and where its file lives.
+        Returns (file_info, spotdl); file_info is None when the chosen downloader has nothing to work with.
+        """
         if downloading_core == "Auto":
             spotdl = True if (spotify_link_info.get('youtube_link') is None) else False
         else:
             spotdl = downloading_core == "SpotDL"
 
         if (spotify_link_info.get('youtube_link', None) is None) and not spotdl:
-            await db.set_file_processing_flag(user_id, 0)
-            return False
+            return None, spotdl
 
-        file_path, filename, is_local = SpotifyDownloader._determine_file_path(spotify_link_info, music_quality, spotdl)
+        file_path, filename, is_local = await SpotifyDownloader._determine_file_path(spotify_link_info, music_quality,
+                                                                                     spotdl)
 
         file_info = {
             "file_name": filename,
             "file_path": file_path,
             "icon_path": SpotifyDownloader._get_icon_path(spotify_link_info),
             "is_local": is_local,
-            "video_url": spotify_link_info.get('youtube_link')
+            "video_url": spotify_link_info.get('youtube_link'),
+            "media_key": TelegramMediaCache.spotify_key(spotify_link_info['track_id'], music_quality)
         }
+        return file_info, spotdl
 
-        if is_local:
-            return await SpotifyDownloader.send_local_file(event, file_info, spotify_link_info, is_playlist)
+    @staticmethod
+    async def download_track(event, spotify_link_info, is_playlist: bool = False, music_quality=None):
+
+        user_id = event.sender_id
+
+        music_quality = music_quality or await db.get_user_music_quality(user_id)
+        downloading_core = await db.get_user_downloading_core(user_id)
+
+        file_info, spotdl = await SpotifyDownloader._build_file_info(spotify_link_info, music_quality, downloading_core)
+        if file_info is None:
+            return False
+        is_local = file_info['is_local']
+
+        started = time.monotonic()
+        if await SpotifyDownloader._send_cached_track(event, file_info, spotify_link_info):
+            result = is_local = True
+        elif is_local:
+            result = await SpotifyDownloader.send_local_file(event, file_info, spotify_link_info, is_playlist)
+        elif SpotifyDownloader.downloads.in_flight(file_info['media_key']):
+            result = is_local = await SpotifyDownloader._follow_download(event, file_info, spotify_link_info,
+                                                                         is_playlist)
         else:
-            return await SpotifyDownloader._handle_download(event, spotify_link_info, music_quality, file_info,
-                                                            spotdl, is_playlist)
+            result = await SpotifyDownloader.downloads.run(file_info['media_key'], SpotifyDownloader._handle_download,
+                                                           event, spotify_link_info, music_quality, file_info,
+                                                           spotdl, is_playlist)
+        if result:
+            await db.record_event('delivery', 'spotify', music_quality['format'], user_id, is_local,
+                                  time.monotonic() - started)
+        return result
+
+    @staticmethod
+    async def _follow_download(event, file_info, spotify_link_info, is_playlist) -> bool:
+        """
+        Waits for another request that is downloading the same track, then sends its upload, or at least its file.
+        """
+        waiting_message = None
+        if not is_playlist:
+            waiting_message = await event.respond("This track is being downloaded for another request right now. "
+                                                  "It will be sent to you as soon as it is ready.")
+        await SpotifyDownloader.downloads.wait(file_info['media_key'])
+        if waiting_message:
+            await waiting_message.delete()
+
+        if await SpotifyDownloader._send_cached_track(event, file_info, spotify_link_info):
+            return True
+        if os.path.isfile(file_info['file_path']):
+            return await SpotifyDownloader.send_local_file(event, file_info, spotify_link_info, is_playlist)
+        if not is_playlist:
+            await event.respond("Sorry, the download of this track failed. Please try again.")
+        return False
 
     @staticmethod
     async def _handle_download(event, spotify_link_info, music_quality, file_info, spotdl, is_playlist):
@@ -717,11 +779,9 @@ class SpotifyDownloader:
                                                                                   is_playlist)
 
             if os.path.isfile(file_path) and result:
+                await MusicCatalog.add(spotify_link_info, music_quality, file_path)
 
-                if not is_playlist:
-                    download_message = await download_message.edit("Downloading . . . .")
-                    download_message = await download_message.edit("Downloading . . . . .")
-
+                if download_message:
                     await download_message.delete()
 
                 send_file_result = await SpotifyDownloader.send_local_file(event, file_info, spotify_link_info,
@@ -731,88 +791,216 @@ class SpotifyDownloader:
                 return False
 
         else:
-            result, message = await SpotifyDownloader.download_spotdl(event, music_quality, spotify_link_info)
-            if not result:
-                result, message = await SpotifyDownloader.download_spotdl(event, music_quality,
-                                                                          spotify_link_info, is_playlist,
-                                                                          message,
-                                                                          audio_option="soundcloud")
-                if not result:
-                    result, _ = await SpotifyDownloader.download_spotdl(event, music_quality, spotify_link_info,
-                                                                        is_playlist,
-                                                                        message, audio_option="youtube")
-            if result and message:
-                return await SpotifyDownloader.send_local_file(event, file_info,
-                                                               spotify_link_info, is_playlist) if result else False
+            if await SpotifyDownloader._download_with_spotdl(event, music_quality, spotify_link_info, file_path,
+                                                             is_playlist):
+                await MusicCatalog.add(spotify_link_info, music_quality, file_path)
+                return await SpotifyDownloader.send_local_file(event, file_info, spotify_link_info, is_playlist)
             else:
                 return False
 
+    @staticmethod
+    async def fetch_youtube_audio(event, file_info, quite: bool = True):
+        """
+        Downloads the best audio stream as-is, without converting it, and returns its path.
+        Used by the playlist pipeline, which transcodes it with transcode_audio.
+        """
+        ydl_opts = {
+            'format': "bestaudio",
+            'default_search': 'ytsearch',
+            'noplaylist': True,
+            "nocheckcertificate": True,
+            "outtmpl": os.path.join(SpotifyDownloader.download_directory, f"{file_info['file_name']}.source.%(ext)s"),
+            "quiet": True,
+            "geo_bypass": True,
+        }
+
+        source_path = await asyncio.to_thread(SpotifyDownloader._download_within_limit, ydl_opts,
+                                              file_info['video_url'])
+        if source_path is None and not quite:
+            await event.respond("Err: File size is more than 50 MB.\nSkipping download.")
+        return source_path
+
+    @staticmethod
+    async def transcode_audio(source_path, file_path, music_quality, spotify_link_info) -> bool:
+        if music_quality['format'] == 'flac':
+            codec_args = ['-c:a', 'flac']
+        else:
+            codec_args = ['-b:a', f"{music_quality['quality']}k"]
+        # Tags come from Spotify rather than the YouTube upload the audio was taken from
+        metadata_args = []
+        for tag, field in (('title', 'track_name'), ('artist', 'artist_name'), ('album', 'album_name'),
+                           ('date', 'release_year'), ('track', 'track_number')):
+            if spotify_link_info.get(field) is not None:
+                metadata_args += ['-metadata', f"{tag}={spotify_link_info[field]}"]
+        process = await asyncio.create_subprocess_exec(
+            'ffmpeg', '-y', '-loglevel', 'error', '-i', source_path, '-vn', '-map_metadata', '-1',
+            *metadata_args, *codec_args, file_path,
+            stdout=asyncio.subprocess.DEVNULL,
+            stderr=asyncio.subprocess.PIPE,
+            stdin=asyncio.subprocess.DEVNULL
+        )
+        _, stderr = await process.communicate()
+        if process.returncode != 0:
+            print(f"Transcoding {source_path} failed: {stderr.decode().strip()}")
+            if os.path.isfile(file_path):
+                os.remove(file_path)
+            return False
+        return True
+
+    @staticmethod
+    async def _produce_spotdl_file(event, spotify_link_info, music_quality, file_path) -> bool:
+        """
+        Downloads a playlist track with spotdl to file_path without sending it, and records it in the catalog.
+        """
+        if not await SpotifyDownloader._download_with_spotdl(event, music_quality, spotify_link_info, file_path,
+                                                             quite=True):
+            return False
+        await MusicCatalog.add(spotify_link_info, music_quality, file_path)
+        return True
+
     @staticmethod
     def _get_icon_path(spotify_link_info):
-        icon_name = f"{spotify_link_info['track_name']} - {spotify_link_info['artist_name']}.jpeg".replace("/", " ")
-        return os.path.join(SpotifyDownloader.download_icon_directory, icon_name)
-
-    @staticmethod
-    def _determine_file_path(spotify_link_info, music_quality, spotdl):
-        artist_names = spotify_link_info['artist_name'].split(', ')
-        for r in range(1, len(artist_names) + 1):
-            for combination in combinations(artist_names, r):
-                filename = f"{', '.join(combination)} - {spotify_link_info['track_name']}".replace("/", "")
-                filename += f"-{music_quality['quality']}" if not spotdl else ""
-                file_path = os.path.join(SpotifyDownloader.download_directory, f"{filename}.{music_quality['format']}")
-                if os.path.isfile(file_path):
-                    return file_path, filename, True
+        return Thumbnails.path_for(spotify_link_info['image_url'])
+
+    @staticmethod
+    async def _determine_file_path(spotify_link_info, music_quality, spotdl):
+        entry = await MusicCatalog.lookup(spotify_link_info['track_id'], music_quality['format'],
+                                          music_quality['quality'], spotify_link_info.get('isrc'))
+        if entry is not None:
+            file_path = entry['file_path']
+            return file_path, os.path.basename(file_path).rsplit('.', 1)[0], True
         filename = f"{spotify_link_info['artist_name']} - {spotify_link_info['track_name']}".replace("/", "")
         filename += f"-{music_quality['quality']}" if not spotdl else ""
         return os.path.join(SpotifyDownloader.download_directory,
                             f"{filename}.{music_quality['format']}"), filename, False
 
     @staticmethod
-    async def download_playlist(event, spotify_link_info, number_of_downloads: str):
+    async def download_playlist(event, spotify_link_info, lease, number_of_downloads: str):
         playlist_id = spotify_link_info["playlist_id"]
-        music_quality = None
-
-        await db.set_file_processing_flag(event.sender_id, 1)
+        user_id = event.sender_id
 
         if number_of_downloads == "10":
-            tracks_info = await SpotifyDownloader.get_playlist_tracks(playlist_id)
+            music_quality = await db.get_user_music_quality(user_id)
+            tracks = SpotifyDownloader.iter_playlist_items(playlist_id, limit=10)
         elif number_of_downloads == "all":
-            music_quality = await db.get_user_music_quality(event.sender_id)
-            new_music_quality = {'format': "mp3", 'quality': 320}
-            await db.set_user_music_quality(event.sender_id, new_music_quality)
-            tracks_info = await SpotifyDownloader.get_playlist_tracks(playlist_id, get_all=True)
+            # Whole playlists are always sent as mp3 320 to keep them within upload limits
+            music_quality = {'format': "mp3", 'quality': '320'}
+            # Streamed page by page, so the first tracks are on their way before the last page is fetched
+            tracks = SpotifyDownloader.iter_playlist_items(playlist_id)
         else:
-            await db.set_file_processing_flag(event.sender_id, 0)
             return await event.respond("Sorry, Something went wrong.\ntry again later.")
+        downloading_core = await db.get_user_downloading_core(user_id)
 
         start_message = await event.respond("Checking the playlist ....")
+        # YouTube jobs whose download flight is resolved by the transcode stage, by media key
+        claimed = {}
 
-        batch_size = 10
-        track_batches = [tracks_info[i:i + batch_size] for i in range(0, len(tracks_info), batch_size)]
-        download_tasks = []
-
-        await start_message.edit("Sending musics.... Please Hold on.")
+        def settle(job, produced):
+            if not job['flight'].done():
+                job['flight'].set_result(produced)
+            claimed.pop(job['file_info']['media_key'], None)
 
-        for batch in track_batches:
-            # Download tracks in the current batch concurrently
-            download_tasks.extend([SpotifyDownloader.download_track(event,
-                                                                    await SpotifyDownloader.extract_data_from_spotify_link(
-                                                                        event, track["track_id"]), is_playlist=True) for
-                                   track in batch])
-
-            # Wait for all downloads in the batch to complete before proceeding to the next batch
-            await asyncio.gather(*download_tasks)
-            download_tasks.clear()  # Clear completed tasks
+        async def resolve(link_info):
+            if downloading_core != "SpotDL":
+                link_info['youtube_link'] = await SpotifyDownloader.extract_yt_video_info(link_info)
+            return link_info
+
+        async def download(link_info):
+            file_info, spotdl = await SpotifyDownloader._build_file_info(link_info, music_quality, downloading_core)
+            if file_info is None:
+                return None
+            job = {'link_info': link_info, 'file_info': file_info, 'source_path': None, 'flight': None,
+                   'started': time.monotonic(), 'cached': False}
+            # A single-track request for the same file is already downloading it, so wait and reuse that
+            if await SpotifyDownloader.downloads.wait(file_info['media_key']):
+                file_info['is_local'] = os.path.isfile(file_info['file_path'])
+            if await TelegramMediaCache.has(file_info['media_key']):
+                # Telegram already has this file, so the upload stage only has to reference it
+                job['cached'] = True
+                return job
+            if file_info['is_local']:
+                return job
+            # Registered like a single-track download, so other requests for this file join it instead of
+            # writing the same file alongside it
+            if spotdl:
+                # spotdl writes the final format itself, so there is nothing left to transcode
+                await SpotifyDownloader.downloads.run(file_info['media_key'], SpotifyDownloader._produce_spotdl_file,
+                                                      event, link_info, music_quality, file_info['file_path'])
+                return job if os.path.isfile(file_info['file_path']) else None
+            # The flight stays open until the transcode stage has written the file
+            job['flight'] = SpotifyDownloader.downloads.claim(file_info['media_key'])
+            if job['flight'] is None:
+                await SpotifyDownloader.downloads.wait(file_info['media_key'])
+                return job if os.path.isfile(file_info['file_path']) else None
+            claimed[file_info['media_key']] = job
+            try:
+                job['source_path'] = await SpotifyDownloader.fetch_youtube_audio(event, file_info)
+            finally:
+                if job['source_path'] is None:
+                    settle(job, False)
+            return job if job['source_path'] else None
+
+        async def transcode(job):
+            source_path = job['source_path']
+            if source_path is None:
+                return job
+            converted = False
+            try:
+                converted = await SpotifyDownloader.transcode_audio(source_path, job['file_info']['file_path'],
+                                                                    music_quality, job['link_info'])
+                if converted:
+                    await MusicCatalog.add(job['link_info'], music_quality, job['file_info']['file_path'])
+            finally:
+                if os.path.isfile(source_path):
+                    os.remove(source_path)
+                settle(job, converted)
+            return job if converted else None
+
+        async def upload(job):
+            if job['cached']:
+                sent = await SpotifyDownloader._send_cached_track(event, job['file_info'], job['link_info'])
+                if not sent:
+                    # The cached document is gone; download_track fetches, sends and records it instead
+                    await SpotifyDownloader.download_track(event, job['link_info'], is_playlist=True,
+                                                           music_quality=music_quality)
+                    lease.renew()
+                    return None
+            else:
+                sent = await SpotifyDownloader.send_local_file(event, job['file_info'], job['link_info'],
+                                                               is_playlist=True)
+            lease.renew()
+            if not sent:
+                return None
+            await db.record_event('delivery', 'spotify', music_quality['format'], user_id,
+                                  job['file_info']['is_local'] or job['cached'], time.monotonic() - job['started'])
+            return job
+
+        # Metadata comes straight from the playlist pages, so hydration happens in the source itself
+        pipeline = (Pipeline(queue_size=SpotifyDownloader.playlist_queue_size)
+                    .add_stage('resolve', resolve, workers=3)
+                    .add_stage('download', download, workers=4)
+                    .add_stage('transcode', transcode, workers=os.cpu_count() or 2)
+                    .add_stage('upload', upload, workers=3))
 
-        await start_message.delete()
-        if music_quality is not None:
-            await db.set_user_music_quality(event.sender_id, music_quality)
-        await db.set_file_processing_flag(event.sender_id, 0)
+        try:
+            await start_message.edit("Sending musics.... Please Hold on.")
+            await pipeline.run(SpotifyDownloader.iter_track_link_infos(tracks))
+        except Exception as e:
+            # Usually the playlist itself failed to load, e.g. a page request that kept failing
+            print(f"Playlist {playlist_id} failed: {e}")
+            return await event.respond("Sorry, Something went wrong while sending the playlist.\ntry again later.")
+        finally:
+            # Jobs the pipeline dropped on its way out must not leave other requests waiting on their flight
+            for job in list(claimed.values()):
+                settle(job, False)
+                if job['source_path'] and os.path.isfile(job['source_path']):
+                    os.remove(job['source_path'])
+            await start_message.delete()
         return await event.respond("Enjoy!\n\nOur bot is OpenSource.", buttons=Buttons.source_code_button)
 
     @staticmethod
     async def search_spotify_based_on_user_input(query, limit=10):
-        results = SpotifyDownloader.spotify_account.search(q=query, limit=limit)
+        results = await SpotifyDownloader.spotify_account.search(q=query, limit=limit)
 
         extracted_details = []
 
@@ -846,7 +1034,7 @@ class SpotifyDownloader:
     async def send_artists_info(event):
         query_data = str(event.data)
         track_id = query_data.split("/")[-1][:-1]
-        track_info = SpotifyDownloader.spotify_account.track(track_id=track_id)
+        track_info = await SpotifyDownloader.get_track(track_id)
         artist_ids = [artist["id"] for artist in track_info['artists']]
         artist_details = []
 
@@ -860,8 +1048,7 @@ class SpotifyDownloader:
             else:
                 return str(number)
 
-        for artist_id in artist_ids:
-            artist = SpotifyDownloader.spotify_account.artist(artist_id.replace("'", ""))
+        for artist in await SpotifyDownloader.get_artists(artist_ids):
             artist_details.append({
                 'name': artist['name'],
                 'followers': format_number(artist['followers']['total']),
@@ -899,7 +1086,7 @@ class SpotifyDownloader:
 
         query_data = str(event.data)
         track_id = query_data.split("/")[-1][:-1]
-        track_info = SpotifyDownloader.spotify_account.track(track_id=track_id)
+        track_info = await SpotifyDownloader.get_track(track_id)
         artist_names = ",".join(artist['name'] for artist in track_info['artists'])
 
         waiting_message = await event.respond("Searching For Lyrics in Genius ....")
@@ -969,30 +1156,57 @@ class SpotifyDownloader:
         except Exception:
             await event.reply("An error occurred while processing your request. Please try again later.")
 
+    @staticmethod
+    def _extract_track_details(track):
+        return {
+            "track_name": track['name'],
+            "artist_name": track['artists'][0]['name'],  # Assuming the first artist is the primary one
+            "release_year": track['album']['release_date'].split("-")[0],  # Format release year as YYYY
+            "track_id": track['id']
+        }
+
+    @staticmethod
+    async def iter_playlist_items(playlist_id, limit: int | None = None, page_size: int = 100):
+        """
+        Yields the playlist's track objects in order, following the `next` links page by page.
+        The following page is already being fetched while the current one is consumed.
+        """
+        if limit is not None:
+            page_size = min(page_size, limit)
+        page = await SpotifyDownloader.spotify_account.playlist_items(playlist_id, limit=page_size,
+                                                                      additional_types=('track',))
+        next_page = None
+        try:
+            while page is not None:
+                if limit is not None:
+                    page['items'] = page['items'][:limit]
+                    limit -= len(page['items'])
+                if page.get('next') and (limit is None or limit > 0):
+                    next_page = asyncio.create_task(SpotifyDownloader.spotify_account.next(page))
+                for item in page['items']:
+                    track = item.get('track')
+                    # Removed tracks come back as None and local files have no id
+                    if track and track.get('type', 'track') == 'track' and track.get('id'):
+                        yield track
+                page = await next_page if next_page is not None else None
+                next_page = None
+        finally:
+            if next_page is not None:
+                next_page.cancel()
+
+    @staticmethod
+    async def iter_playlist_tracks(playlist_id):
+        async for track in SpotifyDownloader.iter_playlist_items(playlist_id):
+            yield SpotifyDownloader._extract_track_details(track)
+
     @staticmethod
     async def get_playlist_tracks(playlist_id, limit: int = 10, get_all: bool = False):
 
         # Retrieve playlist tracks
         if get_all:
-            results = SpotifyDownloader.spotify_account.playlist_items(playlist_id)
-        else:
-            results = SpotifyDownloader.spotify_account.playlist_items(playlist_id, limit=limit)
+            return [track async for track in SpotifyDownloader.iter_playlist_tracks(playlist_id)]
 
-        extracted_details = []
-        for item in results['items']:
-            track = item['track']
-            # Extracting track name, artist's name, release year, and track ID
-            track_name = track['name']
-            artist_name = track['artists'][0]['name']  # Assuming the first artist is the primary one
-            release_year = track['album']['release_date']
-            track_id = track['id']
-
-            # Append the extracted details to the list
-            extracted_details.append({
-                "track_name": track_name,
-                "artist_name": artist_name,
-                "release_year": release_year.split("-")[0],  # Format release year as YYYY
-                "track_id": track_id
-            })
-
-        return extracted_details
+        results = await SpotifyDownloader.spotify_account.playlist_items(playlist_id, limit=limit,
+                                                                         additional_types=('track',))
+        return [SpotifyDownloader._extract_track_details(item['track']) for item in results['items']
+                if item.get('track') and item['track'].get('id')]
@@ -1,8 +1,8 @@
 from run import Button, BotState
 from utils import lru_cache
-from utils import os, hashlib, re, asyncio
+from utils import os, hashlib, re, time
 from utils import db, bs4, aiohttp
-from utils import TweetCapture
+from utils import TweetCapture, SingleFlight
 
 
 class X:
@@ -12,6 +12,8 @@ class X:
         cls.screen_shot_path = 'repository/ScreenShots'
         if not os.path.isdir(cls.screen_shot_path):
             os.makedirs(cls.screen_shot_path, exist_ok=True)
+        # Screenshots being taken, keyed by path, so concurrent requests for a tweet share one browser run
+        cls.screenshots = SingleFlight()
 
     @lru_cache(maxsize=128)  # Cache the last 128 screenshots
     def get_screenshot_path(tweet_url):
@@ -30,12 +32,12 @@ class X:
 
         screenshot_path = X.get_screenshot_path(tweet_url + night_mode)
 
-        if os.path.exists(screenshot_path):
+        # The file may still be half-written while its screenshot is in flight
+        if os.path.exists(screenshot_path) and not X.screenshots.in_flight(screenshot_path):
             await tweet_message.delete()
             return screenshot_path
         try:
-            screenshot_task = asyncio.create_task(TweetCapture.screenshot(tweet_url, screenshot_path, night_mode))
-            await screenshot_task
+            await X.screenshots.run(screenshot_path, TweetCapture.screenshot, tweet_url, screenshot_path, night_mode)
 
             await tweet_message.delete()
             return screenshot_path
@@ -47,6 +49,7 @@ class X:
 
     @staticmethod
     async def send_screenshot(client, event, tweet_url) -> bool:
+        started = time.monotonic()
 
         screenshot_path = await X.take_screenshot_of_tweet(event, tweet_url)
         has_media = await X.has_media(tweet_url)
@@ -68,6 +71,7 @@ class X:
             return False
 
         await screen_shot_message.delete()
+        await db.record_event('delivery', 'x', 'png', event.sender_id, latency=time.monotonic() - started)
         return True
 
     @staticmethod
@@ -7,7 +7,7 @@ from functools import lru_cache
 from concurrent.futures import ThreadPoolExecutor
 
 # yt-dlp wrapper from your utils
-from utils import YoutubeDL, InputMediaPhotoExternal, db
+from utils import YoutubeDL, InputMediaPhotoExternal, JobLeases, db, time, TelegramMediaCache, SingleFlight
 from utils import InputMediaUploadedDocument, DocumentAttributeVideo, fast_upload
 from utils import DocumentAttributeAudio, WebpageMediaEmptyError
 from run import Button, Buttons
@@ -27,6 +27,8 @@ class YoutubeDownloader:
         cls.MAXIMUM_DOWNLOAD_SIZE_MB = 100
         cls.DOWNLOAD_DIR = 'repository/Youtube'
         cls.COOKIES_PATH = 'resources/cookies.txt'  # path used by yt-dlp fallback
+        # Downloads in progress, keyed by media key, so concurrent requests for a file share one download
+        cls.downloads = SingleFlight()
 
         if not os.path.isdir(cls.DOWNLOAD_DIR):
             os.makedirs(cls.DOWNLOAD_DIR, exist_ok=True)
@@ -233,108 +235,139 @@ class YoutubeDownloader:
         """
         user_id = event.sender_id
 
-        if await db.get_file_processing_flag(user_id):
-            return await event.respond("⚙️ Please wait — another file is being processed for you.")
-
         data = event.data.decode('utf-8')
         parts = data.split('/')
         if len(parts) == 3 and parts[0] == 'ytapi':
             video_id = parts[1]
             format_type = parts[2]  # mp3 or mp4
 
-            await db.set_file_processing_flag(user_id, is_processing=True)
-            waiting_msg = await event.respond(f"🎧 Fetching {format_type.upper()} link, please wait up to 90s...")
+            lease = JobLeases.acquire(user_id)
+            if lease is None:
+                return await event.respond("⚙️ Please wait — another file is being processed for you.")
 
-            api_url = f"https://apex.srvopus.workers.dev/arytmp?direct&id={video_id}&format={format_type}"
+            async with lease:
+                return await YoutubeDownloader._download_and_send_api_file(client, event, video_id, format_type)
+        else:
+            await event.answer("Invalid button data.")
 
-            # Fetch API response (wait up to 90 seconds)
-            try:
-                async with aiohttp.ClientSession() as session:
-                    async with session.get(api_url, timeout=90) as resp:
-                        if resp.status == 200:
-                            result = await resp.json()
-                        else:
-                            raise Exception(f"API returned {resp.status}")
-            except asyncio.TimeoutError:
-                await db.set_file_processing_flag(user_id, is_processing=False)
-                return await waiting_msg.edit("⏳ API took too long to respond (timeout 90s). Try again.")
-            except Exception as e:
-                await db.set_file_processing_flag(user_id, is_processing=False)
-                return await waiting_msg.edit(f"❌ Failed to fetch download link.\nReason: {str(e)}")
-
-            # Validate API result
-            if not result.get("status") == "success" or not result.get("download_url"):
-                await db.set_file_processing_flag(user_id, is_processing=False)
-                return await waiting_msg.edit("⚠️ API did not return a valid download URL.")
-
-            download_url = result["download_url"]
-            title = result.get("title", "Downloaded File")
-
-            path = os.path.join(YoutubeDownloader.DOWNLOAD_DIR, f"{video_id}.{format_type}")
-
-            # Download file from API
-            try:
-                async with aiohttp.ClientSession() as session:
-                    async with session.get(download_url, timeout=90) as r:
-                        if r.status != 200:
-                            raise Exception(f"Download failed with HTTP {r.status}")
-                        with open(path, 'wb') as f:
-                            while True:
-                                chunk = await r.content.read(1024 * 1024)
-                                if not chunk:
-                                    break
-                                f.write(chunk)
-            except Exception as e:
-                await db.set_file_processing_flag(user_id, is_processing=False)
-                return await waiting_msg.edit(f"⚠️ Could not download file.\nReason: {str(e)}")
-
-            await waiting_msg.edit("📤 Uploading...")
+    @staticmethod
+    async def _download_and_send_api_file(client, event, video_id, format_type):
+        started = time.monotonic()
+        media_key = TelegramMediaCache.youtube_key(video_id, format_type)
+        if await TelegramMediaCache.send(client, event.chat_id, media_key, supports_streaming=True):
+            await db.record_event('delivery', 'youtube', format_type, event.sender_id, cached=True,
+                                  latency=time.monotonic() - started)
+            return
+
+        if YoutubeDownloader.downloads.in_flight(media_key):
+            return await YoutubeDownloader._follow_api_download(client, event, media_key, format_type, started)
+        return await YoutubeDownloader.downloads.run(media_key, YoutubeDownloader._fetch_and_send_api_file,
+                                                     client, event, video_id, format_type, media_key, started)
 
-            try:
-                async with client.action(event.chat_id, 'document'):
-                    media = await fast_upload(
-                        client=client,
-                        file_location=path,
-                        reply=None,
-                        name=os.path.basename(path),
-                        progress_bar_function=None
-                    )
+    @staticmethod
+    async def _follow_api_download(client, event, media_key, format_type, started):
+        """
+        Waits for another request that is downloading the same file, then sends the document it uploaded.
+        """
+        waiting_msg = await event.respond("⏳ This file is being prepared for another request right now. "
+                                          "It will be sent to you as soon as it is ready.")
+        await YoutubeDownloader.downloads.wait(media_key)
+        if await TelegramMediaCache.send(client, event.chat_id, media_key, supports_streaming=True):
+            await waiting_msg.delete()
+            await db.record_event('delivery', 'youtube', format_type, event.sender_id, cached=True,
+                                  latency=time.monotonic() - started)
+            return
+        await waiting_msg.edit("⚠️ Could not prepare this file. Please try again.")
+
+    @staticmethod
+    async def _fetch_and_send_api_file(client, event, video_id, format_type, media_key, started):
+        waiting_msg = await event.respond(f"🎧 Fetching {format_type.upper()} link, please wait up to 90s...")
 
-                    if format_type == "mp4":
-                        video_attr = DocumentAttributeVideo(
-                            duration=0, w=0, h=0, supports_streaming=True
-                        )
-                        mime = "video/mp4"
-                        attributes = [video_attr]
+        api_url = f"https://apex.srvopus.workers.dev/arytmp?direct&id={video_id}&format={format_type}"
+
+        # Fetch API response (wait up to 90 seconds)
+        try:
+            async with aiohttp.ClientSession() as session:
+                async with session.get(api_url, timeout=90) as resp:
+                    if resp.status == 200:
+                        result = await resp.json()
                     else:
-                        audio_attr = DocumentAttributeAudio(
-                            duration=0,
-                            title=title,
-                            performer="@Socialdownloader1_bot"
-                        )
-                        mime = "audio/mpeg"
-                        attributes = [audio_attr]
-
-                    input_media = InputMediaUploadedDocument(
-                        file=await client.upload_file(media),
-                        mime_type=mime,
-                        attributes=attributes,
-                    )
+                        raise Exception(f"API returned {resp.status}")
+        except asyncio.TimeoutError:
+            return await waiting_msg.edit("⏳ API took too long to respond (timeout 90s). Try again.")
+        except Exception as e:
+            return await waiting_msg.edit(f"❌ Failed to fetch download link.\nReason: {str(e)}")
+
+        # Validate API result
+        if not result.get("status") == "success" or not result.get("download_url"):
+            return await waiting_msg.edit("⚠️ API did not return a valid download URL.")
+
+        download_url = result["download_url"]
+        title = result.get("title", "Downloaded File")
 
-                    await client.send_file(
-                        event.chat_id,
-                        file=input_media,
-                        caption=f"✅ **{title}**\n@Socialdownloader1_bot",
-                        force_document=False,
-                        supports_streaming=True
+        path = os.path.join(YoutubeDownloader.DOWNLOAD_DIR, f"{video_id}.{format_type}")
+
+        # Download file from API
+        try:
+            async with aiohttp.ClientSession() as session:
+                async with session.get(download_url, timeout=90) as r:
+                    if r.status != 200:
+                        raise Exception(f"Download failed with HTTP {r.status}")
+                    with open(path, 'wb') as f:
+                        while True:
+                            chunk = await r.content.read(1024 * 1024)
+                            if not chunk:
+                                break
+                            f.write(chunk)
+        except Exception as e:
+            return await waiting_msg.edit(f"⚠️ Could not download file.\nReason: {str(e)}")
+
+        await waiting_msg.edit("📤 Uploading...")
+
+        try:
+            async with client.action(event.chat_id, 'document'):
+                media = await fast_upload(
+                    client=client,
+                    file_location=path,
+                    reply=None,
+                    name=os.path.basename(path),
+                    progress_bar_function=None
+                )
+
+                if format_type == "mp4":
+                    video_attr = DocumentAttributeVideo(
+                        duration=0, w=0, h=0, supports_streaming=True
+                    )
+                    mime = "video/mp4"
+                    attributes = [video_attr]
+                else:
+                    audio_attr = DocumentAttributeAudio(
+                        duration=0,
+                        title=title,
+                        performer="@Socialdownloader1_bot"
                     )
+                    mime = "audio/mpeg"
+                    attributes = [audio_attr]
 
-                await waiting_msg.delete()
-                await db.set_file_processing_flag(user_id, is_processing=False)
+                input_media = InputMediaUploadedDocument(
+                    file=await client.upload_file(media),
+                    mime_type=mime,
+                    attributes=attributes,
+                )
 
-            except Exception as e:
-                await db.set_file_processing_flag(user_id, is_processing=False)
-                return await event.respond(f"❌ Upload failed.\nReason: {str(e)}")
+                caption = f"✅ **{title}**\n@Socialdownloader1_bot"
+                message = await client.send_file(
+                    event.chat_id,
+                    file=input_media,
+                    caption=caption,
+                    force_document=False,
+                    supports_streaming=True
+                )
+                await TelegramMediaCache.remember(client, media_key, message, caption)
 
-        else:
-            await event.answer("Invalid button data.")
+            await waiting_msg.delete()
+
+        except Exception as e:
+            return await event.respond(f"❌ Upload failed.\nReason: {str(e)}")
+
+        await db.record_event('delivery', 'youtube', format_type, event.sender_id, latency=time.monotonic() - started)
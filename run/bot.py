@@ -1,7 +1,8 @@
-from utils import BroadcastManager, db, asyncio, sanitize_query, TweetCapture
+from utils import BroadcastManager, db, asyncio, sanitize_query, TweetCapture, JobLeases, MusicCatalog, \
+    TelegramMediaCache, run_in_background
 from plugins import SpotifyDownloader, ShazamHelper, X, Insta, YoutubeDownloader
 from run import events, Button, MessageMediaDocument, update_bot_version_user_season, is_user_in_channel, \
-    handle_continue_in_membership_message
+    handle_continue_in_membership_message, with_user_context
 from run import Buttons, BotMessageHandler, BotState, BotCommandHandler, respond_based_on_channel_membership
 
 
@@ -13,6 +14,7 @@ class Bot:
         try:
             Bot.initialize_spotify_downloader()
             await Bot.initialize_database()
+            run_in_background(Bot.sync_music_catalog(), name='sync_music_catalog')
             Bot.initialize_shazam()
             Bot.initialize_x()
             Bot.initialize_instagram()
@@ -36,11 +38,20 @@ class Bot:
     async def initialize_database():
         try:
             await db.initialize_database()
-            await db.reset_all_file_processing_flags()
-            print("Utils: Database initialized and file processing flags reset.")
+            JobLeases.configure(BotState.MAX_JOBS_PER_USER)
+            TelegramMediaCache.configure(BotState.STORAGE_CHANNEL_ID)
+            print("Utils: Database, job leases and media cache initialized.")
         except Exception as e:
             print(f"An error occurred while initializing the database: {str(e)}")
 
+    @staticmethod
+    async def sync_music_catalog():
+        try:
+            added, removed, unidentified = await MusicCatalog.rebuild(SpotifyDownloader.download_directory)
+            print(f"Utils: Music catalog synced ({added} added, {removed} removed, {unidentified} unidentified).")
+        except Exception as e:
+            print(f"An error occurred while syncing the music catalog: {str(e)}")
+
     @staticmethod
     def initialize_shazam():
         try:
@@ -193,8 +204,7 @@ class Bot:
     @staticmethod
     async def process_bot_interaction(event) -> bool:
         user_id = event.sender_id
-        await update_bot_version_user_season(event)
-        if not await db.get_user_updated_flag(user_id):
+        if not await update_bot_version_user_season(event):
             return False
 
         channels_user_is_not_in = await is_user_in_channel(user_id)
@@ -220,12 +230,12 @@ class Bot:
         if send_to_specified:
             await BotState.set_send_to_specified_flag(user_id, True)
 
+        broadcast_id = None
         await BotState.set_admin_broadcast(user_id, True)
         if send_to_all:
-            await BroadcastManager.add_all_users_to_temp()
+            broadcast_id = await BroadcastManager.create_audience(send_to_all=True)
 
         elif send_to_specified:
-            await BroadcastManager.remove_all_users_from_temp()
             time = 60
             time_to_send = await e.respond("Please enter the user_ids (comma-separated) within the next 60 seconds.",
                                            buttons=Bot.cancel_broadcast_button)
@@ -247,8 +257,7 @@ class Bot:
                 parts = await BotState.get_admin_message_to_send(user_id)
                 parts = parts.message.replace(" ", "").split(",")
                 user_ids = [int(part) for part in parts]
-                for user_id in user_ids:
-                    await BroadcastManager.add_user_to_temp(user_id)
+                broadcast_id = await BroadcastManager.create_audience(user_ids=user_ids)
             except:
                 await time_to_send.edit("Invalid command format. Use user_id1,user_id2,...")
                 await BotState.set_admin_message_to_send(user_id, None)
@@ -274,14 +283,14 @@ class Bot:
             await e.respond("There is nothing to send")
             await BotState.set_admin_broadcast(user_id, False)
             await BotState.set_admin_message_to_send(user_id, None)
-            await BroadcastManager.remove_all_users_from_temp()
+            await BroadcastManager.drop_audience(broadcast_id)
             return
 
         try:
             if await BotState.get_admin_broadcast(user_id) and send_to_specified:
-                await BroadcastManager.broadcast_message_to_temp_members(Bot.Client,
-                                                                         await BotState.get_admin_message_to_send(
-                                                                             user_id))
+                await BroadcastManager.broadcast_message_to_audience(Bot.Client, broadcast_id,
+                                                                     await BotState.get_admin_message_to_send(
+                                                                         user_id))
                 await e.respond("Broadcast initiated.")
             elif await BotState.get_admin_broadcast(user_id) and send_to_subs:
                 await BroadcastManager.broadcast_message_to_sub_members(Bot.Client,
@@ -290,17 +299,14 @@ class Bot:
                                                                         Buttons.cancel_subscription_button_quite)
                 await e.respond("Broadcast initiated.")
             elif await BotState.get_admin_broadcast(user_id) and send_to_all:
-                await BroadcastManager.broadcast_message_to_temp_members(Bot.Client,
-                                                                         await BotState.get_admin_message_to_send(
-                                                                             user_id))
+                await BroadcastManager.broadcast_message_to_audience(Bot.Client, broadcast_id,
+                                                                     await BotState.get_admin_message_to_send(
+                                                                         user_id))
                 await e.respond("Broadcast initiated.")
-        except Exception as e:
-            await e.respond(f"Broadcast Failed: {str(e)}")
-            await BotState.set_admin_broadcast(user_id, False)
-            await BotState.set_admin_message_to_send(user_id, None)
-            await BroadcastManager.remove_all_users_from_temp()
+        except Exception as Err:
+            await e.respond(f"Broadcast Failed: {str(Err)}")
 
-        await BroadcastManager.remove_all_users_from_temp()
+        await BroadcastManager.drop_audience(broadcast_id)
         await BotState.set_admin_broadcast(user_id, False)
         await BotState.set_admin_message_to_send(user_id, None)
 
@@ -464,7 +470,7 @@ class Bot:
 
     @staticmethod
     async def handle_youtube_callback(client, event):
-        if event.data.startswith(b"yt/dl/"):
+        if event.data.startswith(b"ytapi/"):
             await YoutubeDownloader.download_and_send_yt_file(client, event)
 
     @staticmethod
@@ -476,9 +482,7 @@ class Bot:
 
     @staticmethod
     async def callback_query_handler(event):
-        user_id = event.sender_id
-        await update_bot_version_user_season(event)
-        if not await db.get_user_updated_flag(user_id):
+        if not await update_bot_version_user_season(event):
             return
 
         action = Bot.button_actions.get(event.data)
@@ -544,7 +548,7 @@ class Bot:
         Bot.Client.add_event_handler(BotCommandHandler.handle_user_info_command,
                                      events.NewMessage(pattern='/user_info'))
 
-        Bot.Client.add_event_handler(Bot.callback_query_handler, events.CallbackQuery)
-        Bot.Client.add_event_handler(Bot.handle_message, events.NewMessage)
+        Bot.Client.add_event_handler(with_user_context(Bot.callback_query_handler), events.CallbackQuery)
+        Bot.Client.add_event_handler(with_user_context(Bot.handle_message), events.NewMessage)
 
         await Bot.Client.run_until_disconnected()
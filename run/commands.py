@@ -1,5 +1,5 @@
 from plugins import SpotifyDownloader
-from utils import db, asyncio, BroadcastManager, time
+from utils import db, asyncio, BroadcastManager, time, SpotifyCache, YoutubeResolver
 from utils import sanitize_query
 from .glob_variables import BotState
 from .buttons import Buttons
@@ -28,12 +28,47 @@ class BotCommandHandler:
     async def handle_stats_command(event):
         if event.sender_id not in ADMIN_USER_IDS:
             return
-        number_of_users = await db.count_all_user_ids()
-        number_of_subscribed = await db.count_subscribed_users()
+        summary = await db.get_stats_summary()
+        number_of_users = summary['users']
+        number_of_subscribed = summary['subscribed']
         number_of_unsubscribed = number_of_users - number_of_subscribed
+
+        def format_ms(value):
+            return f"≤{value / 1000:g}s" if value is not None else "-"
+
+        deliveries = {plugin: entry for (event_type, plugin), entry in summary['events'].items()
+                      if event_type == 'delivery'}
+        total_deliveries = sum(entry['events'] for entry in deliveries.values())
+        total_cached = sum(entry['cached'] for entry in deliveries.values())
+        delivery_lines = "\n".join(
+            f"  {plugin or 'other'}: {entry['events']} (p50 {format_ms(entry.get('p50_ms'))}, "
+            f"p95 {format_ms(entry.get('p95_ms'))})"
+            for plugin, entry in sorted(deliveries.items(), key=lambda item: -item[1]['events'])) or "  none"
+
+        updates = summary['events'].get(('update', ''), {})
+        delivery_hit_ratio = total_cached / total_deliveries if total_deliveries else 0.0
+        pool = db.pool_stats()
+        search_lines = "\n".join(
+            f"  {name}: avg {stats['avg_ms']:.0f} ms, max {stats['max_ms']:.0f} ms, "
+            f"{stats['matches']}/{stats['runs']} matched, {stats['cancelled']} cancelled"
+            for name, stats in YoutubeResolver.stats().items()) or "  none"
+        match_lookups = YoutubeResolver.lookups
+
         await event.respond(f"""Number of Users: {number_of_users}
 Number of Subscribed Users: {number_of_subscribed}
-Number of Unsubscribed Users: {number_of_unsubscribed}""")
+Number of Unsubscribed Users: {number_of_unsubscribed}
+Active Users Today: {summary['active_users']}
+
+Downloads (last {summary['window_hours']}h): {total_deliveries}
+{delivery_lines}
+Served From Cache: {delivery_hit_ratio:.0%}
+Metadata Cache Hit Ratio: {SpotifyCache.memory.hit_ratio():.0%}
+Settings Cache Hit Ratio: {db.settings_cache.hit_ratio():.0%}
+
+Updates (last {summary['window_hours']}h): {updates.get('events', 0)} (p50 {format_ms(updates.get('p50_ms'))}, p95 {format_ms(updates.get('p95_ms'))})
+DB Read Wait: avg {pool['avg_wait_ms']:.1f} ms, max {pool['max_wait_ms']:.1f} ms
+YouTube Matches (since restart): {match_lookups['memory']} from memory, {match_lookups['stored']} stored, {match_lookups['searched']} searched
+{search_lines}""")
 
     @staticmethod
     async def handle_admin_command(event):
@@ -70,10 +105,8 @@ Number of Unsubscribed Users: {number_of_unsubscribed}""")
     @staticmethod
     async def handle_help_command(event):
         if await update_bot_version_user_season(event):
-            user_id = event.sender_id
-            if await db.get_user_updated_flag(user_id):
-                await respond_based_on_channel_membership(event, BotMessageHandler.instruction_message,
-                                                          buttons=Buttons.back_button)
+            await respond_based_on_channel_membership(event, BotMessageHandler.instruction_message,
+                                                      buttons=Buttons.back_button)
 
     @staticmethod
     async def handle_unsubscribe_command(event):
@@ -109,9 +142,11 @@ Number of Unsubscribed Users: {number_of_unsubscribed}""")
         if user_id not in ADMIN_USER_IDS:
             return
 
+        # Broadcasts with an audience snapshot go to that audience, the rest go to subscribers
+        broadcast_id = None
         await BotState.set_admin_broadcast(user_id, True)
         if event.message.text.startswith('/broadcast_to_all'):
-            await BroadcastManager.add_all_users_to_temp()
+            broadcast_id = await BroadcastManager.create_audience(send_to_all=True)
 
         elif event.message.text.startswith('/broadcast'):
             command_parts = event.message.text.split(' ', 1)
@@ -125,11 +160,9 @@ Number of Unsubscribed Users: {number_of_unsubscribed}""")
                 return
 
             if len(command_parts) != 1:
-                await BroadcastManager.remove_all_users_from_temp()
                 user_ids_str = command_parts[1][1:-1]  # Remove the parentheses
-                specified_user_ids = [int(user_id) for user_id in user_ids_str.split(',')]
-                for user_id in specified_user_ids:
-                    await BroadcastManager.add_user_to_temp(user_id)
+                specified_user_ids = [int(specified_id) for specified_id in user_ids_str.split(',')]
+                broadcast_id = await BroadcastManager.create_audience(user_ids=specified_user_ids)
             await BotState.set_admin_message_to_send(user_id, None)
         time = 60
         time_to_send = await event.respond(f"You've Got {time} seconds to send your message",
@@ -145,40 +178,29 @@ Number of Unsubscribed Users: {number_of_unsubscribed}""")
                 break
             await asyncio.sleep(1)
 
-        # Check if the message is "/broadcast_to_all"
         if await BotState.get_admin_message_to_send(user_id) is None and await BotState.get_admin_broadcast(user_id):
             await event.respond("There is nothing to send")
             await BotState.set_admin_broadcast(user_id, False)
             await BotState.set_admin_message_to_send(user_id, None)
-            await BroadcastManager.remove_all_users_from_temp()
+            await BroadcastManager.drop_audience(broadcast_id)
             return
 
         try:
-            if await BotState.get_admin_broadcast(user_id) and len(command_parts) != 1:
-                await BroadcastManager.broadcast_message_to_temp_members(BOT_CLIENT,
-                                                                         await BotState.get_admin_message_to_send(
-                                                                             user_id))
+            if await BotState.get_admin_broadcast(user_id) and broadcast_id is not None:
+                await BroadcastManager.broadcast_message_to_audience(BOT_CLIENT, broadcast_id,
+                                                                     await BotState.get_admin_message_to_send(
+                                                                         user_id))
                 await event.respond("Broadcast initiated.")
-            elif await BotState.get_admin_broadcast(user_id) and len(command_parts) == 1:
+            elif await BotState.get_admin_broadcast(user_id):
                 await BroadcastManager.broadcast_message_to_sub_members(BOT_CLIENT,
                                                                         await BotState.get_admin_message_to_send(
                                                                             user_id),
                                                                         Buttons.cancel_subscription_button_quite)
                 await event.respond("Broadcast initiated.")
-        except:
-            try:
-                if await BotState.get_admin_broadcast(user_id):
-                    await BroadcastManager.broadcast_message_to_temp_members(BOT_CLIENT,
-                                                                             await BotState.get_admin_message_to_send(
-                                                                                 user_id))
-                    await event.respond("Broadcast initiated.")
-            except Exception as e:
-                await event.respond(f"Broadcast Failed: {str(e)}")
-                await BotState.set_admin_broadcast(user_id, False)
-                await BotState.set_admin_message_to_send(user_id, None)
-                await BroadcastManager.remove_all_users_from_temp()
+        except Exception as e:
+            await event.respond(f"Broadcast Failed: {str(e)}")
 
-        await BroadcastManager.remove_all_users_from_temp()
+        await BroadcastManager.drop_audience(broadcast_id)
         await BotState.set_admin_broadcast(user_id, False)
         await BotState.set_admin_message_to_send(user_id, None)
 
@@ -27,6 +27,8 @@ class BotState:
         raise ValueError("Required environment variables are missing.")
 
     ADMIN_USER_IDS = [int(id) for id in ADMIN_USER_IDS]
+    MAX_JOBS_PER_USER = int(os.getenv('MAX_JOBS_PER_USER', 1))
+    STORAGE_CHANNEL_ID = int(os.getenv('STORAGE_CHANNEL_ID')) if os.getenv('STORAGE_CHANNEL_ID') else None
     BOT_CLIENT = TelegramClient('bot', int(API_ID), API_HASH)
 
     # @staticmethod #[DEPRECATED]
@@ -1,11 +1,43 @@
-from utils import db
+from utils import db, wraps, time
+
+
+async def get_user_context(event):
+    """
+    Returns the settings row attached to this update, loading it once if no middleware did.
+    """
+    if not hasattr(event, 'user_settings'):
+        event.user_settings = await db.get_user_settings(event.sender_id)
+    return event.user_settings
+
+
+def with_user_context(handler):
+    """
+    Middleware that loads the sender's settings row once and attaches it to the event.
+    """
+
+    @wraps(handler)
+    async def wrapper(event):
+        # Telethon shares one event object between handlers, so always reload instead of trusting a stale row
+        started = time.monotonic()
+        event.user_settings = await db.get_user_settings(event.sender_id)
+        try:
+            return await handler(event)
+        finally:
+            await db.record_event('update', user_id=event.sender_id, latency=time.monotonic() - started)
+
+    return wrapper
 
 
 async def update_bot_version_user_season(event) -> bool:
     user_id = event.sender_id
-    if not await db.check_username_in_database(user_id):
+    settings = await get_user_context(event)
+    if settings is None or not settings.is_complete:
         await event.respond("We Have Updated The Bot, Please start Over using the /start command.")
-        await db.set_user_updated_flag(user_id, 0)
+        if settings is not None and settings.is_user_updated:
+            await db.set_user_updated_flag(user_id, 0)
+            event.user_settings = await db.get_user_settings(user_id)
         return False
-    await db.set_user_updated_flag(user_id, 1)
+    if not settings.is_user_updated:
+        await db.set_user_updated_flag(user_id, 1)
+        event.user_settings = await db.get_user_settings(user_id)
     return True
@@ -1,5 +1,18 @@
 from utils.broadcast import BroadcastManager
-from utils.database import db
+from utils.database import db, UserSettings
+from utils.cache import TTLCache
+from utils.job_lease import JobLeases, JobLease
+from utils.spotify_cache import SpotifyCache
+from utils.spotify_client import AsyncSpotify
+from utils.pipeline import Pipeline
+from utils.music_catalog import MusicCatalog
+from utils.media_cache import TelegramMediaCache
+from utils.single_flight import SingleFlight
+from utils.thumbnails import Thumbnails
+from utils.progress import ProgressReporter
+from utils.provider_race import ProviderRace
+from utils.spotdl_service import SpotdlService
+from utils.youtube_resolver import YoutubeResolver
 from spotipy.oauth2 import SpotifyClientCredentials
 from yt_dlp.utils import DownloadError
 from dotenv import load_dotenv
@@ -9,7 +22,7 @@ from io import BytesIO
 from yt_dlp import YoutubeDL
 from shazamio import Shazam
 import requests, asyncio, re, os
-import bs4, wget, hashlib, time
+import bs4, wget, hashlib, time, shutil, tempfile
 import lyricsgenius
 import spotipy
 from concurrent.futures import ThreadPoolExecutor
@@ -23,9 +36,9 @@ from telethon.tl.types import (InputMediaUploadedDocument,
 from FastTelethonhelper import fast_upload
 from threading import Thread
 import concurrent
-from functools import lru_cache, partial
+from functools import lru_cache, partial, wraps
 from .tweet_capture import TweetCapture
-from .helper import sanitize_query
+from .helper import sanitize_query, run_in_background
 import io
 import sys
 from dataclasses import dataclass, field
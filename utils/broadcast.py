@@ -3,31 +3,29 @@ from utils.database import db
 
 class BroadcastManager:
 
+    @staticmethod
+    async def _send_to_chunks(client, user_id_chunks, message, button=None):
+        async for user_ids in user_id_chunks:
+            for user_id in user_ids:
+                try:
+                    await client.send_message(user_id, message, buttons=button)
+                except Exception as e:
+                    print(f"Failed to send message to user {user_id}: {e}")
+                    # Optionally, retry sending the message or log the failure for later review
+
     @staticmethod
     async def broadcast_message_to_sub_members(client, message, button=None):
         """
         Sends a message to all users in the broadcast list.
         """
-        user_ids = await db.get_subscribed_user_ids()
-        for user_id in user_ids:
-            try:
-                await client.send_message(user_id, message, buttons=button)
-            except Exception as e:
-                print(f"Failed to send message to user {user_id}: {e}")
-                # Optionally, retry sending the message or log the failure for later review
+        await BroadcastManager._send_to_chunks(client, db.iter_subscribed_user_ids(), message, button)
 
     @staticmethod
-    async def broadcast_message_to_temp_members(client, message):
+    async def broadcast_message_to_audience(client, broadcast_id, message):
         """
-        Sends a message to all users in the broadcast list.
+        Sends a message to every user in the broadcast's audience snapshot.
         """
-        user_ids = await db.get_temporary_subscribed_user_ids()
-        for user_id in user_ids:
-            try:
-                await client.send_message(user_id, message)
-            except Exception as e:
-                print(f"Failed to send message to user {user_id}: {e}")
-                # Optionally, retry sending the message or log the failure for later review
+        await BroadcastManager._send_to_chunks(client, db.iter_broadcast_audience(broadcast_id), message)
 
     @staticmethod
     async def add_sub_user(user_id):  # check
@@ -58,31 +56,28 @@ class BroadcastManager:
         await db.clear_subscribed_users()
 
     @staticmethod
-    async def get_temporary_subscribed_user_ids():  # check
-        """
-        Returns all user IDs in the subscriptions list that are marked as temporarily subscribed.
-        """
-        return await db.get_temporary_subscribed_user_ids()
-
-    @staticmethod
-    async def add_all_users_to_temp():
+    async def create_audience(send_to_all: bool = False, user_ids=None):
         """
-        Adds all users from the database to the broadcast list.
+        Creates an audience snapshot for a single broadcast and returns its id.
         """
-        # Mark the current subscribed users as temporarily added for the broadcast
-        await db.mark_temporary_subscriptions()
+        broadcast_id = await db.create_broadcast_audience()
+        if send_to_all:
+            await db.add_all_users_to_audience(broadcast_id)
+        elif user_ids:
+            await db.add_users_to_audience(broadcast_id, user_ids)
+        return broadcast_id
 
     @staticmethod
-    async def remove_all_users_from_temp():
+    async def add_users_to_audience(broadcast_id, user_ids):
         """
-        Remove all users from the database to the broadcast list.
+        add users from the database to the broadcast's audience.
         """
-        # Mark the current subscribed users as temporarily added for the broadcast
-        await db.mark_temporary_unsubscriptions()
+        await db.add_users_to_audience(broadcast_id, user_ids)
 
     @staticmethod
-    async def add_user_to_temp(user_id):
+    async def drop_audience(broadcast_id):
         """
-        add a user from the database to the broadcast list.
+        Removes the broadcast's audience snapshot once it is no longer needed.
         """
-        await db.add_user_to_temp(user_id)
+        if broadcast_id is not None:
+            await db.drop_broadcast_audience(broadcast_id)
@@ -0,0 +1,67 @@
+from collections import OrderedDict
+import time
+
+
+class TTLCache:
+    """
+    Bounded in-memory cache with LRU eviction and a per-entry time to live.
+    """
+
+    def __init__(self, maxsize=1024, ttl=3600):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        # Bumped on every write so a fill that started before the write can be discarded
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return default
+        value, expires_at = entry
+        if expires_at <= time.monotonic():
+            del self.entries[key]
+            self.misses += 1
+            return default
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key, value, generation=None, ttl=None):
+        """
+        Stores a value. When generation is given and a write happened since it was read,
+        the value is considered stale and dropped.
+        """
+        if generation is not None and generation != self.generation:
+            return
+        ttl = self.ttl if ttl is None else ttl
+        self.entries[key] = (value, time.monotonic() + ttl)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+    def set(self, key, value, ttl=None):
+        """
+        Write-through update: stores the value and invalidates any fill still in flight.
+        """
+        self.generation += 1
+        self.put(key, value, ttl=ttl)
+
+    def pop(self, key):
+        self.generation += 1
+        entry = self.entries.pop(key, None)
+        return entry[0] if entry else None
+
+    def clear(self):
+        self.generation += 1
+        self.entries.clear()
+
+    def hit_ratio(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def __len__(self):
+        return len(self.entries)
@@ -1,52 +1,408 @@
 import aiosqlite
 import json
 import asyncio
+import time
+from bisect import bisect_left
+from dataclasses import dataclass, replace
+from collections import namedtuple
+from .cache import TTLCache
+from .migrations import MIGRATIONS
 
 
 class ConnectionPool:
-    def __init__(self, db_name, max_connections=100):
+    """
+    Bounded pool of read-only connections.
+    Under WAL these run concurrently with each other and with the single BatchWriter connection.
+    """
+
+    def __init__(self, db_name, max_connections=4):
         self.db_name = db_name
         self.max_connections = max_connections
         self.pool = asyncio.Queue()
+        self.opened = 0
+        self.acquired = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
 
     async def get_connection(self):
-        if self.pool.empty():
-            conn = await aiosqlite.connect(self.db_name)
+        started = time.monotonic()
+        if self.pool.empty() and self.opened < self.max_connections:
+            self.opened += 1
+            try:
+                conn = await aiosqlite.connect(f'file:{self.db_name}?mode=ro', uri=True)
+                await conn.execute('PRAGMA query_only=1')
+            except Exception:
+                self.opened -= 1
+                raise
         else:
             conn = await self.pool.get()
+
+        waited = time.monotonic() - started
+        self.acquired += 1
+        self.total_wait += waited
+        self.max_wait = max(self.max_wait, waited)
         return conn
 
     async def release_connection(self, conn):
-        if self.pool.qsize() < self.max_connections:
-            await self.pool.put(conn)
-        else:
+        await self.pool.put(conn)
+
+    async def close(self):
+        while not self.pool.empty():
+            conn = self.pool.get_nowait()
             await conn.close()
+            self.opened -= 1
+
+    def stats(self):
+        return {
+            'connections': self.opened,
+            'idle': self.pool.qsize(),
+            'acquired': self.acquired,
+            'avg_wait_ms': (self.total_wait / self.acquired * 1000) if self.acquired else 0.0,
+            'max_wait_ms': self.max_wait * 1000,
+        }
+
+
+WriteResult = namedtuple('WriteResult', ['rowcount', 'lastrowid'])
+
+
+class BatchWriter:
+    """
+    Owns the only write connection to the database.
+    Queued statements are grouped into one transaction per flush window, and each caller's
+    future resolves once that transaction has been committed and synced to disk.
+    """
+
+    def __init__(self, db_name, flush_interval=0.01, max_batch_size=256, max_retries=5, retry_backoff=0.05):
+        self.db_name = db_name
+        self.flush_interval = flush_interval
+        self.max_batch_size = max_batch_size
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.queue = asyncio.Queue()
+        self.conn = None
+        self.task = None
+        self.start_lock = asyncio.Lock()
+
+    async def start(self):
+        async with self.start_lock:
+            if self.task is not None:
+                return
+            # isolation_level=None: transactions are opened and committed explicitly per batch
+            self.conn = await aiosqlite.connect(self.db_name, isolation_level=None)
+            await self.conn.execute('PRAGMA journal_mode=WAL')
+            # FULL syncs the WAL on every commit, so a resolved future means the write survives a power loss;
+            # with one commit per batch that costs one fsync per flush window rather than per statement
+            await self.conn.execute('PRAGMA synchronous=FULL')
+            await self.conn.execute('PRAGMA busy_timeout=5000')
+            self.task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self.task is None:
+            return
+        await self.queue.put(None)
+        await self.task
+        await self.conn.close()
+        self.task = None
+        self.conn = None
+
+    async def submit(self, query, params=()):
+        """
+        Queues a write and returns a future that resolves to the statement's WriteResult after commit.
+        A list of statements as query is applied all-or-nothing.
+        """
+        if self.task is None:
+            await self.start()
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((query, params, future))
+        return future
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            item = await self.queue.get()
+            if item is None:
+                return
+            batch = [item]
+            stopping = False
+            deadline = loop.time() + self.flush_interval
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self.queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+            await self._flush(batch)
+            if stopping:
+                return
+
+    async def _flush(self, batch):
+        for attempt in range(self.max_retries + 1):
+            try:
+                results = await self._execute_batch(batch)
+            except aiosqlite.OperationalError as e:
+                if 'database is locked' in str(e) and attempt < self.max_retries:
+                    await asyncio.sleep(self.retry_backoff * 2 ** attempt)
+                    continue
+                results = [e] * len(batch)
+            except Exception as e:
+                results = [e] * len(batch)
+
+            for (_, _, future), result in zip(batch, results):
+                if future.done():
+                    continue
+                if isinstance(result, Exception):
+                    future.set_exception(result)
+                else:
+                    future.set_result(result)
+            return
+
+    async def _execute_batch(self, batch):
+        results = []
+        await self.conn.execute('BEGIN IMMEDIATE')
+        try:
+            for query, params, _ in batch:
+                # A savepoint per statement keeps one bad write from rolling back the whole batch
+                await self.conn.execute('SAVEPOINT batch_write')
+                try:
+                    if isinstance(query, list):
+                        for statement in query:
+                            await self.conn.execute(statement)
+                        results.append(WriteResult(-1, None))
+                    else:
+                        async with self.conn.execute(query, params) as c:
+                            results.append(WriteResult(c.rowcount, c.lastrowid))
+                except aiosqlite.Error as e:
+                    if 'database is locked' in str(e):
+                        raise
+                    await self.conn.execute('ROLLBACK TO batch_write')
+                    results.append(e)
+                await self.conn.execute('RELEASE batch_write')
+            await self.conn.execute('COMMIT')
+        except BaseException:
+            if self.conn.in_transaction:
+                await self.conn.execute('ROLLBACK')
+            raise
+        return results
+
+
+class DownloadCounter:
+    """
+    Buffers per-track download increments in memory and flushes them as one upsert batch.
+    Reads combine the persisted count with whatever is still buffered.
+    """
+
+    # Three bound parameters per row keeps every statement under SQLite's variable limit
+    rows_per_statement = 300
+
+    def __init__(self, flush_interval=5.0):
+        self.flush_interval = flush_interval
+        self.pending = {}
+        self.flushing = {}
+        self.isrcs = {}
+        self.persisted = TTLCache(maxsize=10000, ttl=3600)
+        self.flushed = asyncio.Event()
+        self.flushed.set()
+        self.task = None
+
+    def increment(self, track_id, isrc=None):
+        self.pending[track_id] = self.pending.get(track_id, 0) + 1
+        if isrc:
+            self.isrcs[track_id] = isrc
+        if self.task is None:
+            self.task = asyncio.create_task(self._run())
+
+    async def get(self, track_id):
+        if track_id in self.flushing:
+            # Until the flush settles it is unknown whether the row already holds the flushing count
+            await self.flushed.wait()
+        buffered = self.pending.get(track_id, 0) + self.flushing.get(track_id, 0)
+        persisted = self.persisted.get(track_id)
+        if persisted is None:
+            generation = self.persisted.generation
+            result = await db.fetch_one('SELECT downloads FROM track_downloads WHERE track_id = ?', (track_id,))
+            persisted = result[0] if result else 0
+            self.persisted.put(track_id, persisted, generation)
+        return persisted + buffered
+
+    def total_buffered(self):
+        return sum(self.pending.values()) + sum(self.flushing.values())
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    async def flush(self):
+        if not self.pending or self.flushing:
+            return
+        self.flushing, self.pending = self.pending, {}
+        self.flushed.clear()
+        rows = [(track_id, self.isrcs.pop(track_id, None), count) for track_id, count in self.flushing.items()]
+        # Dropped before the write instead of adjusted after it, so the next read goes to the committed row
+        for track_id, _, _ in rows:
+            self.persisted.pop(track_id)
+        try:
+            futures = []
+            for i in range(0, len(rows), self.rows_per_statement):
+                chunk = rows[i:i + self.rows_per_statement]
+                query = ('INSERT INTO track_downloads (track_id, isrc, downloads) VALUES '
+                         + ', '.join(['(?, ?, ?)'] * len(chunk))
+                         + ' ON CONFLICT(track_id) DO UPDATE SET downloads = downloads + excluded.downloads, '
+                           'isrc = COALESCE(excluded.isrc, isrc)')
+                futures.append(await db.submit_query(query, [value for row in chunk for value in row]))
+            # The writer commits all chunks in the same transaction
+            await asyncio.gather(*futures)
+        except Exception as e:
+            print(f"Failed to flush download counters: {e}")
+            for track_id, isrc, count in rows:
+                self.pending[track_id] = self.pending.get(track_id, 0) + count
+                if isrc:
+                    self.isrcs.setdefault(track_id, isrc)
+        finally:
+            self.flushing = {}
+            self.flushed.set()
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+        await self.flush()
+
+
+class EventLog:
+    """
+    Buffers stats events in memory and appends them to stats_events in batches.
+    Triggers on stats_events keep the hourly and daily rollups current, so reads never touch the log itself.
+    """
+
+    # Eight bound parameters per row keeps every statement under SQLite's variable limit
+    rows_per_statement = 120
+    # Upper bounds of the latency histogram; anything slower lands in the last bucket
+    latency_buckets_ms = (50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000, 60000, 120000, 300000, 3600000)
+    # Raw events are only kept for this long; the rollups hold everything /stats reads
+    retention_days = 7
+    prune_interval = 3600
+
+    def __init__(self, flush_interval=5.0):
+        self.flush_interval = flush_interval
+        self.pending = []
+        self.last_prune = 0.0
+        self.task = None
+
+    def record(self, event_type, plugin='', format='', user_id=None, cached=False, latency=None):
+        latency_ms = None if latency is None else int(latency * 1000)
+        latency_bucket = None
+        if latency_ms is not None:
+            index = min(bisect_left(self.latency_buckets_ms, latency_ms), len(self.latency_buckets_ms) - 1)
+            latency_bucket = self.latency_buckets_ms[index]
+        self.pending.append((int(time.time()), event_type, plugin or '', format or '', user_id,
+                             1 if cached else 0, latency_ms, latency_bucket))
+        if self.task is None:
+            self.task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+            if time.monotonic() - self.last_prune >= self.prune_interval:
+                await self.prune()
+
+    async def prune(self):
+        """
+        Deletes raw events older than retention_days, and the active-user markers of days before them.
+        """
+        self.last_prune = time.monotonic()
+        cutoff = int(time.time()) - self.retention_days * 86400
+        try:
+            # event_id grows with time, so the first recent event bounds the old ones without an occurred_at index
+            await db.execute_query(
+                'DELETE FROM stats_events WHERE event_id < COALESCE('
+                '(SELECT event_id FROM stats_events WHERE occurred_at >= ? ORDER BY event_id LIMIT 1), '
+                '(SELECT MAX(event_id) + 1 FROM stats_events))', (cutoff,))
+            await db.execute_query('DELETE FROM stats_active_users WHERE day < ?', (cutoff - cutoff % 86400,))
+        except Exception as e:
+            print(f"Failed to prune stats events: {e}")
+
+    async def flush(self):
+        if not self.pending:
+            return
+        rows, self.pending = self.pending, []
+        futures = []
+        for i in range(0, len(rows), self.rows_per_statement):
+            chunk = rows[i:i + self.rows_per_statement]
+            query = ('INSERT INTO stats_events (occurred_at, event_type, plugin, format, user_id, cached, '
+                     'latency_ms, latency_bucket) VALUES ' + ', '.join(['(?, ?, ?, ?, ?, ?, ?, ?)'] * len(chunk)))
+            futures.append(await db.submit_query(query, [value for row in chunk for value in row]))
+
+        results = await asyncio.gather(*futures, return_exceptions=True)
+        failed = [e for e in results if isinstance(e, Exception)]
+        if failed:
+            print(f"Failed to flush stats events: {failed[0]}")
+            # Each chunk is its own savepoint, so only requeue the ones that were rolled back
+            for i, result in enumerate(results):
+                if isinstance(result, Exception):
+                    self.pending[:0] = rows[i * self.rows_per_statement:(i + 1) * self.rows_per_statement]
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+        await self.flush()
+
+
+@dataclass(frozen=True)
+class UserSettings:
+    user_id: int
+    music_quality: dict
+    downloading_core: str | None
+    tweet_capture_settings: dict
+    is_user_updated: bool
+
+    @classmethod
+    def from_row(cls, user_id, row):
+        music_quality, downloading_core, tweet_capture_settings, is_user_updated = row
+        return cls(
+            user_id=user_id,
+            music_quality=json.loads(music_quality) if music_quality else {},
+            downloading_core=downloading_core,
+            tweet_capture_settings=json.loads(tweet_capture_settings) if tweet_capture_settings else {},
+            is_user_updated=bool(is_user_updated),
+        )
+
+    @property
+    def is_complete(self):
+        return self.downloading_core is not None and self.music_quality != {} and self.tweet_capture_settings != {}
 
 
 class db:
     db_name = 'user_settings.db'
     pool = ConnectionPool(db_name)
-    lock = asyncio.Lock()
+    writer = BatchWriter(db_name)
+    settings_cache = TTLCache(maxsize=10000, ttl=3600)
+    download_counter = DownloadCounter()
+    event_log = EventLog()
 
     @staticmethod
     async def initialize_database():
-        conn = await db.get_connection()
-        try:
-            await conn.execute('''CREATE TABLE IF NOT EXISTS user_settings
-                                (user_id INTEGER PRIMARY KEY, music_quality TEXT, downloading_core TEXT,
-                                tweet_capture_settings TEXT,
-                                is_file_processing BOOLEAN DEFAULT 0,is_user_updated BOOLEAN DEFAULT 1)'''
-                               )
-            await conn.execute('''CREATE TABLE IF NOT EXISTS subscriptions
-                                (user_id INTEGER PRIMARY KEY, subscribed BOOLEAN DEFAULT   1, temporary BOOLEAN DEFAULT   0)''')
-            await conn.execute('''CREATE TABLE IF NOT EXISTS musics
-                                        (filename TEXT PRIMARY KEY, downloads INTEGER DEFAULT 1)''')
-            await conn.commit()
-        except:
-            raise
-        await db.create_trigger()
+        await db.writer.start()
+        await db.migrate()
         await db.set_default_values()
 
+    @staticmethod
+    async def migrate():
+        current_version = (await db.fetch_one('PRAGMA user_version'))[0]
+        for version, statements in enumerate(MIGRATIONS, start=1):
+            if version <= current_version:
+                continue
+            await db.execute_transaction(statements + [f'PRAGMA user_version = {version}'])
+            print(f"Utils: Database migrated to version {version}.")
+
     @classmethod
     async def set_default_values(cls):
         cls.default_downloading_core: str = "Auto"
@@ -61,62 +417,62 @@ class db:
     async def release_connection(conn):
         await db.pool.release_connection(conn)
 
+    @staticmethod
+    async def close():
+        await db.download_counter.stop()
+        await db.event_log.stop()
+        # Lets SQLite refresh statistics for tables whose shape changed a lot during this run
+        await db.execute_query('PRAGMA optimize')
+        await db.writer.stop()
+        await db.pool.close()
+
+    @staticmethod
+    async def submit_query(query, params=()):
+        """
+        Queues a write on the batch writer and returns its future without waiting for the commit.
+        """
+        return await db.writer.submit(query, params)
+
     @staticmethod
     async def execute_query(query, params=()):
-        async with db.lock:
-            conn = await db.get_connection()
-            try:
-                async with conn.cursor() as c:
-                    await c.execute(query, params)
-                    await conn.commit()
-            except aiosqlite.OperationalError as e:
-                if 'database is locked' in str(e):
-                    await db.execute_query(query, params)
-                else:
-                    raise e
-            finally:
-                await db.release_connection(conn)
+        return await (await db.submit_query(query, params))
+
+    @staticmethod
+    async def execute_transaction(statements):
+        """
+        Runs the statements in one transaction; either all of them are committed or none.
+        """
+        return await (await db.submit_query(list(statements)))
 
     @staticmethod
     async def fetch_one(query, params=()):
-        async with db.lock:
-            conn = await db.get_connection()
-            try:
-                async with conn.cursor() as c:
-                    try:
-                        await c.execute(query, params)
-                        return await c.fetchone()
-                    except Exception as e:
-                        print(f"Error executing query: {query}")
-                        print(f"Parameters: {params}")
-                        print(f"Error details: {e}")
-                        raise e
-            finally:
-                await db.release_connection(conn)
+        conn = await db.get_connection()
+        try:
+            async with conn.cursor() as c:
+                try:
+                    await c.execute(query, params)
+                    return await c.fetchone()
+                except Exception as e:
+                    print(f"Error executing query: {query}")
+                    print(f"Parameters: {params}")
+                    print(f"Error details: {e}")
+                    raise e
+        finally:
+            await db.release_connection(conn)
 
     @staticmethod
     async def fetch_all(query, params=()):
-        async with db.lock:
-            conn = await db.get_connection()
-            try:
-                async with conn.cursor() as c:
-                    await c.execute(query, params)
-                    return await c.fetchall()
-            finally:
-                await db.release_connection(conn)
+        conn = await db.get_connection()
+        try:
+            async with conn.cursor() as c:
+                await c.execute(query, params)
+                return await c.fetchall()
+        finally:
+            await db.release_connection(conn)
 
     @staticmethod
-    async def create_trigger():
-        await db.execute_query('DROP TRIGGER IF EXISTS add_user_to_subscriptions')
-        trigger_sql = '''
-        CREATE TRIGGER add_user_to_subscriptions
-        AFTER INSERT ON user_settings
-        BEGIN
-            INSERT INTO subscriptions (user_id, subscribed, temporary)
-            VALUES (NEW.user_id, 1, 0);
-        END;
-        '''
-        await db.execute_query(trigger_sql)
+    def pool_stats():
+        return db.pool.stats()
 
     @staticmethod
     async def create_user_settings(user_id):
@@ -133,47 +489,63 @@ class db:
         await db.execute_query('''INSERT OR REPLACE INTO user_settings
                           (user_id, music_quality, downloading_core, tweet_capture_settings) VALUES (?, ?, ?, ?)''',
                                (user_id, music_quality, downloading_core, tweet_capture_setting))
+        db.settings_cache.set(user_id, UserSettings.from_row(
+            user_id, (music_quality, downloading_core, tweet_capture_setting, True)))
 
     @staticmethod
     async def check_username_in_database(user_id):
-        query = "SELECT COUNT(*) FROM user_settings WHERE user_id = ?"
-        result = await db.fetch_one(query, (user_id,))
-        if result:
-            count = result[0]
-            if count > 0 and await db.get_user_downloading_core(user_id) is not None:
-                if await db.get_user_music_quality(user_id) != {} and await db.get_user_tweet_capture_settings(
-                        user_id) != {}:
-                    return True
+        settings = await db.get_user_settings(user_id)
+        return settings is not None and settings.is_complete
+
+    @staticmethod
+    async def get_user_settings(user_id) -> UserSettings | None:
+        """
+        Returns the user's settings, served from the in-memory cache after the first load.
+        """
+        settings = db.settings_cache.get(user_id)
+        if settings is not None:
+            return settings
+
+        generation = db.settings_cache.generation
+        result = await db.fetch_one('SELECT music_quality, downloading_core, tweet_capture_settings, is_user_updated '
+                                    'FROM user_settings WHERE user_id = ?', (user_id,))
+        if result is None:
+            return None
+        settings = UserSettings.from_row(user_id, result)
+        db.settings_cache.put(user_id, settings, generation)
+        return settings
+
+    @staticmethod
+    def _update_cached_settings(user_id, **changes):
+        settings = db.settings_cache.get(user_id)
+        if settings is not None:
+            db.settings_cache.set(user_id, replace(settings, **changes))
         else:
-            return False
+            db.settings_cache.pop(user_id)
 
     @staticmethod
     async def get_user_music_quality(user_id):
-        result = await db.fetch_one('SELECT music_quality FROM user_settings WHERE user_id = ?', (user_id,))
-        if result:
-            music_quality = json.loads(result[0])
-            return music_quality
-        else:
-            return {}
+        settings = await db.get_user_settings(user_id)
+        # Callers may mutate the returned dict, so never hand out the cached one
+        return dict(settings.music_quality) if settings else {}
 
     @staticmethod
     async def get_user_downloading_core(user_id):
-        result = await db.fetch_one('SELECT downloading_core FROM user_settings WHERE user_id = ?', (user_id,))
-        if result:
-            return result[0]
-        else:
-            return None
+        settings = await db.get_user_settings(user_id)
+        return settings.downloading_core if settings else None
 
     @staticmethod
     async def set_user_music_quality(user_id, music_quality):
         serialized_dict = json.dumps(music_quality)
         await db.execute_query('UPDATE user_settings SET music_quality = ? WHERE user_id = ?',
                                (serialized_dict, user_id))
+        db._update_cached_settings(user_id, music_quality=dict(music_quality))
 
     @staticmethod
     async def set_user_downloading_core(user_id, downloading_core):
         await db.execute_query('UPDATE user_settings SET downloading_core = ? WHERE user_id = ?',
                                (downloading_core, user_id))
+        db._update_cached_settings(user_id, downloading_core=downloading_core)
 
     @staticmethod
     async def get_all_user_ids():
@@ -181,15 +553,8 @@ class db:
 
     @staticmethod
     async def count_all_user_ids():
-        return (await db.fetch_one('SELECT COUNT(*) FROM user_settings'))[0]
-
-    @staticmethod
-    async def add_user_to_temp(user_id):
-        await db.execute_query('''UPDATE subscriptions SET temporary = 1 WHERE user_id = ?''', (user_id,))
-
-    @staticmethod
-    async def remove_user_from_temp(user_id):
-        await db.execute_query('''UPDATE subscriptions SET temporary = 0 WHERE user_id = ?''', (user_id,))
+        result = await db.fetch_one("SELECT value FROM stats_counters WHERE name = 'users'")
+        return result[0] if result else 0
 
     @staticmethod
     async def add_subscribed_user(user_id):
@@ -203,21 +568,63 @@ class db:
     async def get_subscribed_user_ids():
         return [row[0] for row in await db.fetch_all('SELECT user_id FROM subscriptions WHERE subscribed = 1')]
 
+    @staticmethod
+    async def iter_user_id_chunks(query, params=(), chunk_size=500):
+        """
+        Streams user ids in chunks using keyset pagination.
+        The query must select user_id, take its fixed params first and end with
+        'user_id > ? ORDER BY user_id LIMIT ?'.
+        """
+        last_user_id = -2 ** 63
+        while True:
+            rows = await db.fetch_all(query, (*params, last_user_id, chunk_size))
+            if not rows:
+                return
+            yield [row[0] for row in rows]
+            if len(rows) < chunk_size:
+                return
+            last_user_id = rows[-1][0]
+
+    @staticmethod
+    def iter_subscribed_user_ids(chunk_size=500):
+        return db.iter_user_id_chunks('SELECT user_id FROM subscriptions WHERE subscribed = 1 '
+                                      'AND user_id > ? ORDER BY user_id LIMIT ?', chunk_size=chunk_size)
+
     @staticmethod
     async def clear_subscribed_users():
         await db.execute_query('''UPDATE subscriptions SET subscribed = 0''')
 
     @staticmethod
-    async def mark_temporary_subscriptions():
-        await db.execute_query('''UPDATE subscriptions SET temporary = 1''')
+    async def create_broadcast_audience():
+        result = await db.execute_query('INSERT INTO broadcasts DEFAULT VALUES')
+        return result.lastrowid
+
+    @staticmethod
+    async def add_all_users_to_audience(broadcast_id):
+        await db.execute_query('''INSERT OR IGNORE INTO broadcast_audience (broadcast_id, user_id)
+                                  SELECT ?, user_id FROM subscriptions''', (broadcast_id,))
+
+    @staticmethod
+    async def add_users_to_audience(broadcast_id, user_ids, chunk_size=500):
+        # Only users known to the bot are added, matching the old per-row UPDATE on subscriptions
+        user_ids = list(user_ids)
+        futures = []
+        for i in range(0, len(user_ids), chunk_size):
+            chunk = user_ids[i:i + chunk_size]
+            query = ('''INSERT OR IGNORE INTO broadcast_audience (broadcast_id, user_id)
+                       SELECT ?, user_id FROM subscriptions WHERE user_id IN (%s)''' % ', '.join('?' * len(chunk)))
+            futures.append(await db.submit_query(query, (broadcast_id, *chunk)))
+        await asyncio.gather(*futures)
 
     @staticmethod
-    async def mark_temporary_unsubscriptions():
-        await db.execute_query('''UPDATE subscriptions SET temporary = 0''')
+    def iter_broadcast_audience(broadcast_id, chunk_size=500):
+        return db.iter_user_id_chunks('SELECT user_id FROM broadcast_audience WHERE broadcast_id = ? '
+                                      'AND user_id > ? ORDER BY user_id LIMIT ?', (broadcast_id,), chunk_size)
 
     @staticmethod
-    async def get_temporary_subscribed_user_ids():
-        return [row[0] for row in await db.fetch_all('SELECT user_id FROM subscriptions WHERE temporary = 1')]
+    async def drop_broadcast_audience(broadcast_id):
+        await db.execute_query('DELETE FROM broadcast_audience WHERE broadcast_id = ?', (broadcast_id,))
+        await db.execute_query('DELETE FROM broadcasts WHERE broadcast_id = ?', (broadcast_id,))
 
     @staticmethod
     async def is_user_subscribed(user_id):
@@ -247,7 +654,7 @@ class db:
 
     @staticmethod
     async def count_subscribed_users():
-        result = await db.fetch_one('SELECT COUNT(*) FROM subscriptions WHERE subscribed = 1')
+        result = await db.fetch_one("SELECT value FROM stats_counters WHERE name = 'subscribed'")
         return result[0] if result else 0
 
     @staticmethod
@@ -255,63 +662,178 @@ class db:
         is_user_updated_value = 1 if is_user_updated else 0
         await db.execute_query('UPDATE user_settings SET is_user_updated = ? WHERE user_id = ?',
                                (is_user_updated_value, user_id))
+        db._update_cached_settings(user_id, is_user_updated=bool(is_user_updated_value))
 
     @staticmethod
     async def get_user_updated_flag(user_id):
-        result = await db.fetch_one('SELECT is_user_updated FROM user_settings WHERE user_id = ?', (user_id,))
-        if result:
-            return bool(result[0])
-        return False
+        settings = await db.get_user_settings(user_id)
+        return settings.is_user_updated if settings else False
 
     @staticmethod
-    async def set_file_processing_flag(user_id, is_processing):
-        is_processing_value = 1 if is_processing else 0
-        await db.execute_query('UPDATE user_settings SET is_file_processing = ? WHERE user_id = ?',
-                               (is_processing_value, user_id))
+    async def increment_track_downloads(track_id, isrc=None):
+        """
+        Counts a delivered track. The increment is buffered and persisted on the next counter flush.
+        """
+        db.download_counter.increment(track_id, isrc)
 
     @staticmethod
-    async def get_file_processing_flag(user_id):
-        result = await db.fetch_one('SELECT is_file_processing FROM user_settings WHERE user_id = ?', (user_id,))
-        if result:
-            return bool(result[0]) if result[0] else False
-        return False  # Return False if the file is not found or the flag is not set
+    async def get_track_downloads(track_id):
+        return await db.download_counter.get(track_id)
 
     @staticmethod
-    async def reset_all_file_processing_flags():
-        await db.execute_query('UPDATE user_settings SET is_file_processing = 0')
+    async def get_total_downloads():
+        # musics holds the legacy per-filename counters recorded before track_downloads existed
+        result = await db.fetch_one('SELECT (SELECT COALESCE(SUM(downloads), 0) FROM musics) + '
+                                    '(SELECT COALESCE(SUM(downloads), 0) FROM track_downloads)')
+        return (result[0] if result else 0) + db.download_counter.total_buffered()
 
     @staticmethod
-    async def increment_download_counter(filename):
-        await db.execute_query('UPDATE musics SET downloads = downloads + 1 WHERE filename = ?', (filename,))
+    async def record_event(event_type, plugin='', format='', user_id=None, cached=False, latency=None):
+        """
+        Appends an event to the stats log. latency is in seconds; cached marks a delivery served without downloading.
+        """
+        db.event_log.record(event_type, plugin, format, user_id, cached, latency)
 
     @staticmethod
-    async def add_or_increment_song(filename):
-        try:
-            query = 'INSERT INTO musics (filename) VALUES (?)'
-            await db.execute_query(query, (filename,))
-        except aiosqlite.IntegrityError:
-            query = 'UPDATE musics SET downloads = downloads + 1 WHERE filename = ?'
-            await db.execute_query(query, (filename,))
+    def _percentile(histogram, fraction):
+        total = sum(histogram.values())
+        if not total:
+            return None
+        seen = 0
+        for upper_ms in sorted(histogram):
+            seen += histogram[upper_ms]
+            if seen >= total * fraction:
+                return upper_ms
+
+    @staticmethod
+    async def get_stats_summary(window_hours=24):
+        """
+        Reads the counters and the hourly rollups of the last window_hours.
+        Cost depends on the window and the number of plugins, never on how many users or events exist.
+        """
+        now = int(time.time())
+        since = now - now % 3600 - (window_hours - 1) * 3600
+        counters = dict(await db.fetch_all('SELECT name, value FROM stats_counters'))
+        active_users = await db.fetch_one(
+            "SELECT events FROM stats_rollups WHERE bucket_size = 86400 AND bucket_start = ? "
+            "AND event_type = 'active_user' AND plugin = '' AND format = ''", (now - now % 86400,))
+
+        totals = {}
+        for event_type, plugin, events, cached, latency_total in await db.fetch_all(
+                'SELECT event_type, plugin, SUM(events), SUM(cached), SUM(latency_total) FROM stats_rollups '
+                'WHERE bucket_size = 3600 AND bucket_start >= ? GROUP BY event_type, plugin', (since,)):
+            totals[(event_type, plugin)] = {'events': events, 'cached': cached, 'latency_total': latency_total}
+
+        histograms = {}
+        for event_type, plugin, upper_ms, events in await db.fetch_all(
+                'SELECT event_type, plugin, upper_ms, SUM(events) FROM stats_latency '
+                'WHERE bucket_size = 3600 AND bucket_start >= ? GROUP BY event_type, plugin, upper_ms', (since,)):
+            histograms.setdefault((event_type, plugin), {})[upper_ms] = events
+        for key, histogram in histograms.items():
+            entry = totals.setdefault(key, {'events': 0, 'cached': 0, 'latency_total': 0})
+            entry['p50_ms'] = db._percentile(histogram, 0.5)
+            entry['p95_ms'] = db._percentile(histogram, 0.95)
+
+        return {
+            'users': counters.get('users', 0),
+            'subscribed': counters.get('subscribed', 0),
+            'active_users': active_users[0] if active_users else 0,
+            'window_hours': window_hours,
+            'events': totals,
+        }
+
+    @staticmethod
+    async def get_youtube_match(track_id, isrc=None):
+        """
+        Returns the stored match for the track, falling back to any release sharing its ISRC.
+        """
+        result = await db.fetch_one('SELECT video_url, duration_delta, confidence, checked_at FROM youtube_matches '
+                                    'WHERE track_id = ?', (track_id,))
+        if result is None and isrc:
+            result = await db.fetch_one('SELECT video_url, duration_delta, confidence, checked_at FROM youtube_matches '
+                                        'WHERE isrc = ? ORDER BY checked_at DESC LIMIT 1', (isrc,))
+        if result is None:
+            return None
+        video_url, duration_delta, confidence, checked_at = result
+        return {'video_url': video_url, 'duration_delta': duration_delta, 'confidence': confidence,
+                'checked_at': checked_at}
+
+    @staticmethod
+    async def set_youtube_match(track_id, isrc, video_url, duration_delta=None, confidence=None):
+        await db.execute_query('INSERT OR REPLACE INTO youtube_matches '
+                               '(track_id, isrc, video_url, duration_delta, confidence, checked_at) '
+                               'VALUES (?, ?, ?, ?, ?, ?)',
+                               (track_id, isrc, video_url, duration_delta, confidence, time.time()))
+
+    @staticmethod
+    async def get_catalog_entry(track_id, format, quality, isrc=None):
+        """
+        Looks a stored file up by track id, falling back to another release of the same recording via ISRC.
+        """
+        columns = 'track_id, format, quality, isrc, file_path, size, duration_ms'
+        result = await db.fetch_one(f'SELECT {columns} FROM music_catalog '
+                                    'WHERE track_id = ? AND format = ? AND quality = ?', (track_id, format, quality))
+        if result is None and isrc:
+            result = await db.fetch_one(f'SELECT {columns} FROM music_catalog '
+                                        'WHERE isrc = ? AND format = ? AND quality = ? LIMIT 1', (isrc, format, quality))
+        if result is None:
+            return None
+        return dict(zip(('track_id', 'format', 'quality', 'isrc', 'file_path', 'size', 'duration_ms'), result))
 
     @staticmethod
-    async def get_total_downloads():
-        result = await db.fetch_one('SELECT SUM(downloads) FROM musics')
-        return result[0] if result else 0
+    async def add_catalog_entry(track_id, format, quality, isrc, file_path, size, duration_ms=None):
+        await db.execute_query('INSERT OR REPLACE INTO music_catalog '
+                               '(track_id, format, quality, isrc, file_path, size, duration_ms, added_at) '
+                               'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                               (track_id, format, str(quality), isrc, file_path, size, duration_ms, time.time()))
 
     @staticmethod
-    async def get_song_downloads(filename):
-        result = await db.fetch_one('SELECT downloads FROM musics WHERE filename = ?', (filename,))
-        return result[0] if result else 0
+    async def remove_catalog_file(file_path):
+        await db.execute_query('DELETE FROM music_catalog WHERE file_path = ?', (file_path,))
+
+    @staticmethod
+    async def get_catalog_paths():
+        return {row[0] for row in await db.fetch_all('SELECT DISTINCT file_path FROM music_catalog')}
+
+    @staticmethod
+    async def get_telegram_media(media_key):
+        result = await db.fetch_one('SELECT document_id, access_hash, file_reference, channel_message_id, caption '
+                                    'FROM telegram_media WHERE media_key = ?', (media_key,))
+        if result is None:
+            return None
+        return dict(zip(('document_id', 'access_hash', 'file_reference', 'channel_message_id', 'caption'), result))
+
+    @staticmethod
+    async def set_telegram_media(media_key, document_id, access_hash, file_reference, channel_message_id=None,
+                                 caption=None):
+        await db.execute_query('INSERT OR REPLACE INTO telegram_media (media_key, document_id, access_hash, '
+                               'file_reference, channel_message_id, caption, stored_at) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                               (media_key, document_id, access_hash, file_reference, channel_message_id, caption,
+                                time.time()))
+
+    @staticmethod
+    async def delete_telegram_media(media_key):
+        await db.execute_query('DELETE FROM telegram_media WHERE media_key = ?', (media_key,))
 
     @staticmethod
     async def set_user_tweet_capture_settings(user_id, tweet_capture_settings):
         serialized_info = json.dumps(tweet_capture_settings)
         await db.execute_query('UPDATE user_settings SET tweet_capture_settings = ? WHERE user_id = ?',
                                (serialized_info, user_id))
+        db._update_cached_settings(user_id, tweet_capture_settings=dict(tweet_capture_settings))
 
     @staticmethod
     async def get_user_tweet_capture_settings(user_id):
-        result = await db.fetch_one('SELECT tweet_capture_settings FROM user_settings WHERE user_id = ?', (user_id,))
-        if result is not None:
-            return json.loads(result[0]) if result[0] else {}
-        return {}  # Return an empty dictionary if the user is not found or the Spotify link info is not set
+        settings = await db.get_user_settings(user_id)
+        return dict(settings.tweet_capture_settings) if settings else {}
+
+    @staticmethod
+    async def get_spotify_object(object_type, object_id):
+        result = await db.fetch_one('SELECT data, fetched_at FROM spotify_objects WHERE object_type = ? AND object_id = ?',
+                                    (object_type, object_id))
+        return (json.loads(result[0]), result[1]) if result else None
+
+    @staticmethod
+    async def set_spotify_object(object_type, object_id, data):
+        await db.execute_query('INSERT OR REPLACE INTO spotify_objects (object_type, object_id, data, fetched_at) '
+                               'VALUES (?, ?, ?, ?)', (object_type, object_id, json.dumps(data), time.time()))
@@ -1,5 +1,8 @@
+import asyncio
 import re
 
+background_tasks = set()
+
 
 async def sanitize_query(query):
     # Remove non-alphanumeric characters and spaces
@@ -7,3 +10,20 @@ async def sanitize_query(query):
     # Trim leading and trailing spaces
     sanitized_query = sanitized_query.strip()
     return sanitized_query
+
+
+def _background_task_done(task):
+    background_tasks.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        print(f"Background task {task.get_name()} failed: {task.exception()!r}")
+
+
+def run_in_background(coro, name=None):
+    """
+    Starts coro as a task nobody awaits. The task stays referenced until it finishes, so it cannot be
+    garbage-collected halfway, and a failure is printed instead of being lost.
+    """
+    task = asyncio.create_task(coro, name=name)
+    background_tasks.add(task)
+    task.add_done_callback(_background_task_done)
+    return task
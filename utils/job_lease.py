@@ -0,0 +1,84 @@
+import itertools
+import time
+
+
+class JobLease:
+    """
+    A claim on one of a user's job slots. Released when the `async with` block exits,
+    or automatically once it expires.
+    """
+
+    def __init__(self, user_id, lease_id, ttl):
+        self.user_id = user_id
+        self.lease_id = lease_id
+        self.ttl = ttl
+        self.expires_at = time.monotonic() + ttl
+
+    @property
+    def expired(self):
+        return self.expires_at <= time.monotonic()
+
+    def renew(self):
+        """
+        Pushes the expiry back; long-running jobs such as playlists call this as they make progress.
+        """
+        self.expires_at = time.monotonic() + self.ttl
+
+    def release(self):
+        JobLeases.release(self)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        self.release()
+
+
+class JobLeases:
+    max_jobs_per_user = 1
+    lease_ttl = 1800
+    active = {}
+    _lease_ids = itertools.count(1)
+
+    @classmethod
+    def configure(cls, max_jobs_per_user: int = 1, lease_ttl: int = 1800):
+        cls.max_jobs_per_user = max(1, max_jobs_per_user)
+        cls.lease_ttl = lease_ttl
+
+    @classmethod
+    def _user_leases(cls, user_id):
+        leases = cls.active.get(user_id, {})
+        for lease_id in [lease_id for lease_id, lease in leases.items() if lease.expired]:
+            del leases[lease_id]
+        if not leases:
+            cls.active.pop(user_id, None)
+        return leases
+
+    @classmethod
+    def acquire(cls, user_id) -> JobLease | None:
+        """
+        Returns a lease if the user has a free job slot, otherwise None.
+        """
+        leases = cls._user_leases(user_id)
+        if len(leases) >= cls.max_jobs_per_user:
+            return None
+        lease = JobLease(user_id, next(cls._lease_ids), cls.lease_ttl)
+        cls.active.setdefault(user_id, {})[lease.lease_id] = lease
+        return lease
+
+    @classmethod
+    def release(cls, lease: JobLease):
+        leases = cls.active.get(lease.user_id)
+        if leases is None:
+            return
+        leases.pop(lease.lease_id, None)
+        if not leases:
+            del cls.active[lease.user_id]
+
+    @classmethod
+    def is_busy(cls, user_id) -> bool:
+        return len(cls._user_leases(user_id)) >= cls.max_jobs_per_user
+
+    @classmethod
+    def count(cls, user_id) -> int:
+        return len(cls._user_leases(user_id))
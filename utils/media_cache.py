@@ -0,0 +1,110 @@
+from telethon.errors.rpcerrorlist import FileReferenceExpiredError, FileReferenceInvalidError, MediaEmptyError
+from telethon.tl.types import InputDocument
+from .cache import TTLCache
+from .database import db
+
+
+class TelegramMediaCache:
+    """
+    Remembers the Telegram document behind every file the bot has sent, so the next request for the same
+    track or video is answered by re-sending that document instead of uploading the file again.
+    With a storage channel configured each document is also posted there once; its file reference can then
+    be refreshed from that message after it expires, which keeps entries usable across restarts and sessions.
+    """
+
+    storage_channel = None
+    memory = TTLCache(maxsize=4096, ttl=6 * 3600)
+
+    @classmethod
+    def configure(cls, storage_channel=None):
+        cls.storage_channel = storage_channel
+
+    @staticmethod
+    def spotify_key(track_id, music_quality):
+        return f"spotify:{track_id}:{music_quality['format']}:{music_quality['quality']}"
+
+    @staticmethod
+    def youtube_key(video_id, format_type):
+        return f"youtube:{video_id}:{format_type}"
+
+    @classmethod
+    async def get(cls, media_key):
+        entry = cls.memory.get(media_key)
+        if entry is None:
+            generation = cls.memory.generation
+            entry = await db.get_telegram_media(media_key)
+            if entry is not None:
+                cls.memory.put(media_key, entry, generation)
+        return entry
+
+    @classmethod
+    async def has(cls, media_key) -> bool:
+        return await cls.get(media_key) is not None
+
+    @classmethod
+    async def forget(cls, media_key):
+        cls.memory.pop(media_key)
+        await db.delete_telegram_media(media_key)
+
+    @classmethod
+    async def _refresh(cls, client, media_key, entry):
+        if cls.storage_channel is None or entry['channel_message_id'] is None:
+            return None
+        message = await client.get_messages(cls.storage_channel, ids=entry['channel_message_id'])
+        document = getattr(getattr(message, 'media', None), 'document', None)
+        if document is None:
+            return None
+        entry = dict(entry, document_id=document.id, access_hash=document.access_hash,
+                     file_reference=document.file_reference)
+        cls.memory.set(media_key, entry)
+        await db.set_telegram_media(media_key, **entry)
+        return entry
+
+    @classmethod
+    async def send(cls, client, chat_id, media_key, caption=None, **kwargs):
+        """
+        Sends the cached document for media_key. Returns the sent message, or None when nothing usable is cached.
+        caption defaults to the one stored with the document.
+        """
+        entry = await cls.get(media_key)
+        if entry is None:
+            return None
+        for attempt in range(2):
+            document = InputDocument(id=entry['document_id'], access_hash=entry['access_hash'],
+                                     file_reference=entry['file_reference'])
+            try:
+                return await client.send_file(chat_id, document,
+                                              caption=entry['caption'] if caption is None else caption, **kwargs)
+            except (FileReferenceExpiredError, FileReferenceInvalidError):
+                entry = await cls._refresh(client, media_key, entry) if attempt == 0 else None
+                if entry is None:
+                    break
+            except MediaEmptyError:
+                break
+            except Exception as e:
+                print(f"Failed to send cached media {media_key}: {e}")
+                return None
+        await cls.forget(media_key)
+        return None
+
+    @classmethod
+    async def remember(cls, client, media_key, message, caption=None):
+        """
+        Stores the document of a message the bot just sent, mirroring it to the storage channel if there is one.
+        """
+        document = getattr(getattr(message, 'media', None), 'document', None)
+        if document is None:
+            return
+        channel_message_id = None
+        if cls.storage_channel is not None:
+            try:
+                # Sends the existing document by reference, so nothing is uploaded again
+                stored = await client.send_file(cls.storage_channel, document, caption=media_key)
+                channel_message_id = stored.id
+            except Exception as e:
+                print(f"Failed to store {media_key} in the storage channel: {e}")
+        entry = {'document_id': document.id, 'access_hash': document.access_hash,
+                 'file_reference': document.file_reference, 'channel_message_id': channel_message_id,
+                 'caption': caption}
+        cls.memory.set(media_key, entry)
+        await db.set_telegram_media(media_key, **entry)
@@ -0,0 +1,142 @@
+"""
+Schema migrations, applied in order by db.migrate().
+Migration N (1-based) brings the database to PRAGMA user_version N. Each migration runs in a single
+transaction together with the user_version bump, so a failed migration leaves the schema untouched.
+Never edit a released migration; append a new one instead.
+"""
+
+MIGRATIONS = [
+    # 1: baseline schema. IF NOT EXISTS keeps this safe on databases created before versioning.
+    [
+        '''CREATE TABLE IF NOT EXISTS user_settings
+        (user_id INTEGER PRIMARY KEY, music_quality TEXT, downloading_core TEXT,
+        tweet_capture_settings TEXT,
+        is_file_processing BOOLEAN DEFAULT 0,is_user_updated BOOLEAN DEFAULT 1)''',
+        '''CREATE TABLE IF NOT EXISTS subscriptions
+        (user_id INTEGER PRIMARY KEY, subscribed BOOLEAN DEFAULT 1, temporary BOOLEAN DEFAULT 0)''',
+        '''CREATE TABLE IF NOT EXISTS musics
+        (filename TEXT PRIMARY KEY, downloads INTEGER DEFAULT 1)''',
+        '''CREATE TABLE IF NOT EXISTS track_downloads
+        (track_id TEXT PRIMARY KEY, isrc TEXT, downloads INTEGER DEFAULT 0)''',
+        '''CREATE TABLE IF NOT EXISTS broadcasts
+        (broadcast_id INTEGER PRIMARY KEY AUTOINCREMENT, created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)''',
+        '''CREATE TABLE IF NOT EXISTS broadcast_audience
+        (broadcast_id INTEGER, user_id INTEGER, PRIMARY KEY (broadcast_id, user_id)) WITHOUT ROWID''',
+        '''CREATE TRIGGER IF NOT EXISTS add_user_to_subscriptions
+        AFTER INSERT ON user_settings
+        BEGIN
+            INSERT INTO subscriptions (user_id, subscribed, temporary)
+            VALUES (NEW.user_id, 1, 0);
+        END''',
+    ],
+    # 2: columns used by the admin helpers, hot-path indexes and planner statistics
+    [
+        'ALTER TABLE user_settings ADD COLUMN is_admin BOOLEAN DEFAULT 0',
+        'ALTER TABLE user_settings ADD COLUMN admin_broadcast BOOLEAN DEFAULT 0',
+        'CREATE INDEX IF NOT EXISTS idx_subscriptions_subscribed ON subscriptions (user_id) WHERE subscribed = 1',
+        'CREATE INDEX IF NOT EXISTS idx_track_downloads_isrc ON track_downloads (isrc)',
+        'ANALYZE',
+    ],
+    # 3: Spotify Web API responses shared by all Spotify handlers
+    [
+        '''CREATE TABLE IF NOT EXISTS spotify_objects
+        (object_type TEXT, object_id TEXT, data TEXT, fetched_at REAL,
+        PRIMARY KEY (object_type, object_id)) WITHOUT ROWID''',
+    ],
+    # 4: append-only stats event log plus rollups the triggers keep current, so /stats never scans a table
+    [
+        '''CREATE TABLE IF NOT EXISTS stats_events
+        (event_id INTEGER PRIMARY KEY, occurred_at INTEGER, event_type TEXT, plugin TEXT DEFAULT '',
+        format TEXT DEFAULT '', user_id INTEGER, cached BOOLEAN DEFAULT 0, latency_ms INTEGER, latency_bucket INTEGER)''',
+        '''CREATE TABLE IF NOT EXISTS stats_rollups
+        (bucket_size INTEGER, bucket_start INTEGER, event_type TEXT, plugin TEXT, format TEXT,
+        events INTEGER DEFAULT 0, cached INTEGER DEFAULT 0, latency_total INTEGER DEFAULT 0,
+        PRIMARY KEY (bucket_size, bucket_start, event_type, plugin, format)) WITHOUT ROWID''',
+        '''CREATE TABLE IF NOT EXISTS stats_latency
+        (bucket_size INTEGER, bucket_start INTEGER, event_type TEXT, plugin TEXT, upper_ms INTEGER,
+        events INTEGER DEFAULT 0,
+        PRIMARY KEY (bucket_size, bucket_start, event_type, plugin, upper_ms)) WITHOUT ROWID''',
+        '''CREATE TABLE IF NOT EXISTS stats_active_users
+        (day INTEGER, user_id INTEGER, PRIMARY KEY (day, user_id)) WITHOUT ROWID''',
+        '''CREATE TABLE IF NOT EXISTS stats_counters
+        (name TEXT PRIMARY KEY, value INTEGER DEFAULT 0) WITHOUT ROWID''',
+        '''INSERT OR REPLACE INTO stats_counters (name, value)
+        SELECT 'users', COUNT(*) FROM user_settings
+        UNION ALL SELECT 'subscribed', COUNT(*) FROM subscriptions WHERE subscribed = 1''',
+        '''CREATE TRIGGER IF NOT EXISTS roll_up_stats_event
+        AFTER INSERT ON stats_events
+        BEGIN
+            INSERT INTO stats_rollups (bucket_size, bucket_start, event_type, plugin, format, events, cached, latency_total)
+            VALUES (3600, NEW.occurred_at - NEW.occurred_at % 3600, NEW.event_type, NEW.plugin, NEW.format,
+                    1, NEW.cached, COALESCE(NEW.latency_ms, 0)),
+                   (86400, NEW.occurred_at - NEW.occurred_at % 86400, NEW.event_type, NEW.plugin, NEW.format,
+                    1, NEW.cached, COALESCE(NEW.latency_ms, 0))
+            ON CONFLICT (bucket_size, bucket_start, event_type, plugin, format) DO UPDATE SET
+                events = events + 1, cached = cached + excluded.cached,
+                latency_total = latency_total + excluded.latency_total;
+            INSERT INTO stats_latency (bucket_size, bucket_start, event_type, plugin, upper_ms, events)
+            SELECT 3600, NEW.occurred_at - NEW.occurred_at % 3600, NEW.event_type, NEW.plugin, NEW.latency_bucket, 1
+            WHERE NEW.latency_bucket IS NOT NULL
+            UNION ALL
+            SELECT 86400, NEW.occurred_at - NEW.occurred_at % 86400, NEW.event_type, NEW.plugin, NEW.latency_bucket, 1
+            WHERE NEW.latency_bucket IS NOT NULL
+            ON CONFLICT (bucket_size, bucket_start, event_type, plugin, upper_ms) DO UPDATE SET events = events + 1;
+            INSERT OR IGNORE INTO stats_active_users (day, user_id)
+            SELECT NEW.occurred_at - NEW.occurred_at % 86400, NEW.user_id WHERE NEW.user_id IS NOT NULL;
+        END''',
+        '''CREATE TRIGGER IF NOT EXISTS count_active_user
+        AFTER INSERT ON stats_active_users
+        BEGIN
+            INSERT INTO stats_rollups (bucket_size, bucket_start, event_type, plugin, format, events)
+            VALUES (86400, NEW.day, 'active_user', '', '', 1)
+            ON CONFLICT (bucket_size, bucket_start, event_type, plugin, format) DO UPDATE SET events = events + 1;
+        END''',
+        # BEFORE triggers still see the old row, so INSERT OR REPLACE of an existing user is not counted twice
+        '''CREATE TRIGGER IF NOT EXISTS count_new_user
+        BEFORE INSERT ON user_settings
+        WHEN NOT EXISTS (SELECT 1 FROM user_settings WHERE user_id = NEW.user_id)
+        BEGIN
+            UPDATE stats_counters SET value = value + 1 WHERE name = 'users';
+        END''',
+        '''CREATE TRIGGER IF NOT EXISTS count_deleted_user
+        AFTER DELETE ON user_settings
+        BEGIN
+            UPDATE stats_counters SET value = value - 1 WHERE name = 'users';
+        END''',
+        '''CREATE TRIGGER IF NOT EXISTS count_new_subscription
+        BEFORE INSERT ON subscriptions
+        BEGIN
+            UPDATE stats_counters
+            SET value = value + COALESCE(NEW.subscribed, 1)
+                - COALESCE((SELECT subscribed FROM subscriptions WHERE user_id = NEW.user_id), 0)
+            WHERE name = 'subscribed';
+        END''',
+        '''CREATE TRIGGER IF NOT EXISTS count_subscription_change
+        AFTER UPDATE OF subscribed ON subscriptions
+        WHEN NEW.subscribed IS NOT OLD.subscribed
+        BEGIN
+            UPDATE stats_counters SET value = value + NEW.subscribed - OLD.subscribed WHERE name = 'subscribed';
+        END''',
+    ],
+    # 5: Spotify to YouTube matches; video_url is NULL for tracks known to have no acceptable match
+    [
+        '''CREATE TABLE IF NOT EXISTS youtube_matches
+        (track_id TEXT PRIMARY KEY, isrc TEXT, video_url TEXT, duration_delta REAL, confidence REAL,
+        checked_at REAL) WITHOUT ROWID''',
+        'CREATE INDEX IF NOT EXISTS idx_youtube_matches_isrc ON youtube_matches (isrc)',
+    ],
+    # 6: catalog of the audio files kept in repository/Musics
+    [
+        '''CREATE TABLE IF NOT EXISTS music_catalog
+        (track_id TEXT, format TEXT, quality TEXT, isrc TEXT, file_path TEXT, size INTEGER, duration_ms INTEGER,
+        added_at REAL, PRIMARY KEY (track_id, format, quality)) WITHOUT ROWID''',
+        'CREATE INDEX IF NOT EXISTS idx_music_catalog_isrc ON music_catalog (isrc, format, quality)',
+        'CREATE INDEX IF NOT EXISTS idx_music_catalog_file_path ON music_catalog (file_path)',
+    ],
+    # 7: Telegram documents of files already sent, reused instead of uploading again
+    [
+        '''CREATE TABLE IF NOT EXISTS telegram_media
+        (media_key TEXT PRIMARY KEY, document_id INTEGER, access_hash INTEGER, file_reference BLOB,
+        channel_message_id INTEGER, caption TEXT, stored_at REAL) WITHOUT ROWID''',
+    ],
+]
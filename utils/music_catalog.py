@@ -0,0 +1,116 @@
+import asyncio
+import os
+import re
+import mutagen
+from .database import db
+
+
+class MusicCatalog:
+    """
+    Index of the audio files kept in the music repository, keyed by Spotify track id, format and quality.
+    Finding out whether a track is local is one indexed lookup instead of probing file names on disk.
+    """
+
+    audio_extensions = ('mp3', 'flac', 'm4a', 'opus', 'ogg', 'wav')
+    # Quality values the settings menu offers, used to file scanned tracks under the nearest one
+    known_qualities = {'flac': ('693',), 'mp3': ('320', '128')}
+    track_url_pattern = re.compile(r'open\.spotify\.com/track/([A-Za-z0-9]{22})')
+    isrc_pattern = re.compile(r'\b([A-Z]{2}[A-Z0-9]{3}\d{7})\b')
+
+    @staticmethod
+    async def lookup(track_id, format, quality, isrc=None):
+        entry = await db.get_catalog_entry(track_id, format, str(quality), isrc)
+        if entry is None:
+            return None
+        # A single stat guards against files that were deleted behind the bot's back
+        if not os.path.isfile(entry['file_path']):
+            await db.remove_catalog_file(entry['file_path'])
+            return None
+        return entry
+
+    @staticmethod
+    async def add(link_info, music_quality, file_path) -> bool:
+        if not os.path.isfile(file_path):
+            return False
+        await db.add_catalog_entry(link_info['track_id'], music_quality['format'], music_quality['quality'],
+                                   link_info.get('isrc'), file_path, os.path.getsize(file_path),
+                                   link_info.get('duration_ms'))
+        return True
+
+    @staticmethod
+    def _tag_texts(tags):
+        for key, value in tags.items():
+            values = value if isinstance(value, list) else [value]
+            for item in values:
+                text = item.decode(errors='ignore') if isinstance(item, bytes) else str(item)
+                yield str(key), text
+
+    @staticmethod
+    def _identify(file_path):
+        """
+        Reads the Spotify track id and ISRC spotdl embeds in its tags.
+        Returns (track_id, isrc, quality, duration_ms) or None when the file cannot be identified.
+        """
+        try:
+            audio = mutagen.File(file_path)
+        except Exception:
+            return None
+        if audio is None or not audio.tags:
+            return None
+
+        track_id = isrc = None
+        for key, text in MusicCatalog._tag_texts(audio.tags):
+            match = MusicCatalog.track_url_pattern.search(text)
+            if match and track_id is None:
+                track_id = match.group(1)
+            if isrc is None and ('isrc' in key.lower() or key == 'TSRC'):
+                match = MusicCatalog.isrc_pattern.search(text.upper())
+                isrc = match.group(1) if match else None
+        if track_id is None:
+            return None
+
+        format = file_path.rsplit('.', 1)[-1].lower()
+        stem = os.path.basename(file_path).rsplit('.', 1)[0]
+        # Files written by the YouTube downloader carry the requested quality as a -<quality> suffix
+        suffix = re.search(r'-(\d+)$', stem)
+        qualities = MusicCatalog.known_qualities.get(format)
+        if suffix:
+            quality = suffix.group(1)
+        elif qualities:
+            bitrate = getattr(audio.info, 'bitrate', 0) / 1000
+            quality = min(qualities, key=lambda value: abs(int(value) - bitrate))
+        else:
+            return None
+        duration_ms = int(getattr(audio.info, 'length', 0) * 1000) or None
+        return track_id, isrc, quality, duration_ms
+
+    @staticmethod
+    async def rebuild(directory):
+        """
+        Re-syncs the catalog with the directory: rows whose file is gone are dropped, and files that are
+        not catalogued yet are added when their tags identify the track.
+        Returns (added, removed, unidentified).
+        """
+        def list_audio_files():
+            with os.scandir(directory) as entries:
+                return {entry.path for entry in entries
+                        if entry.is_file() and entry.name.rsplit('.', 1)[-1].lower() in MusicCatalog.audio_extensions}
+
+        on_disk = await asyncio.to_thread(list_audio_files)
+        known = await db.get_catalog_paths()
+
+        removed = known - on_disk
+        for file_path in removed:
+            await db.remove_catalog_file(file_path)
+
+        added = unidentified = 0
+        for file_path in on_disk - known:
+            identity = await asyncio.to_thread(MusicCatalog._identify, file_path)
+            if identity is None:
+                unidentified += 1
+                continue
+            track_id, isrc, quality, duration_ms = identity
+            await db.add_catalog_entry(track_id, file_path.rsplit('.', 1)[-1].lower(), quality, isrc, file_path,
+                                       os.path.getsize(file_path), duration_ms)
+            added += 1
+        return added, len(removed), unidentified
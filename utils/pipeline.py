@@ -0,0 +1,86 @@
+import asyncio
+import time
+
+
+class Pipeline:
+    """
+    Streams items through a chain of stages connected by bounded queues.
+    Every stage has its own workers, so while one item uploads the next is being transcoded,
+    the one after that downloaded, and so on. A stage handler returns the item for the next
+    stage, or None to drop it.
+    """
+
+    _done = object()
+
+    def __init__(self, queue_size=8):
+        self.queue_size = queue_size
+        self.stages = []
+        self.stats = {}
+
+    def add_stage(self, name, handler, workers=1):
+        self.stages.append((name, handler, max(1, workers)))
+        self.stats[name] = {'processed': 0, 'dropped': 0, 'failed': 0, 'busy': 0.0}
+        return self
+
+    async def _feed(self, source, queue, workers):
+        if hasattr(source, '__aiter__'):
+            try:
+                async for item in source:
+                    await queue.put(item)
+            finally:
+                # Lets generators release what they hold (e.g. a prefetched page) when the run is cancelled
+                if hasattr(source, 'aclose'):
+                    await source.aclose()
+        else:
+            for item in source:
+                await queue.put(item)
+        for _ in range(workers):
+            await queue.put(self._done)
+
+    async def _work(self, name, handler, inbox, outbox):
+        stats = self.stats[name]
+        while True:
+            item = await inbox.get()
+            if item is self._done:
+                return
+            started = time.monotonic()
+            try:
+                result = await handler(item)
+            except Exception as e:
+                print(f"Pipeline stage {name} failed: {e}")
+                stats['failed'] += 1
+                continue
+            finally:
+                stats['busy'] += time.monotonic() - started
+            if result is None:
+                stats['dropped'] += 1
+                continue
+            stats['processed'] += 1
+            if outbox is not None:
+                await outbox.put(result)
+
+    async def _run_stage(self, name, handler, workers, inbox, outbox, next_workers):
+        await asyncio.gather(*(self._work(name, handler, inbox, outbox) for _ in range(workers)))
+        if outbox is not None:
+            for _ in range(next_workers):
+                await outbox.put(self._done)
+
+    async def run(self, source):
+        """
+        Pushes every item of source (an iterable or async iterable) through the stages and
+        returns the per-stage counters once the last item has left the final stage.
+        """
+        queues = [asyncio.Queue(maxsize=self.queue_size) for _ in self.stages]
+        tasks = [asyncio.create_task(self._feed(source, queues[0], self.stages[0][2]))]
+        for index, (name, handler, workers) in enumerate(self.stages):
+            last = index == len(self.stages) - 1
+            tasks.append(asyncio.create_task(self._run_stage(
+                name, handler, workers, queues[index],
+                None if last else queues[index + 1],
+                None if last else self.stages[index + 1][2])))
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+        return self.stats
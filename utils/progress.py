@@ -0,0 +1,109 @@
+import asyncio
+import time
+
+
+class ProgressReporter:
+    """
+    Mirrors the progress of a download into a Telegram message.
+    Only the latest state is kept: the message is edited at most once per interval,
+    and never with the text it already shows, so progress output does not eat into
+    the flood-wait budget the actual deliveries need.
+    """
+
+    interval = 3.0
+
+    def __init__(self, message, interval=None):
+        self.message = message
+        self.interval = self.interval if interval is None else interval
+        self.loop = asyncio.get_running_loop()
+        self.text = None
+        self.sent_text = None
+        self.last_edit = 0.0
+        self.flusher = None
+        self.closed = False
+
+    def update(self, text):
+        """
+        Records the latest progress text; the message catches up with it within one interval.
+        """
+        if text is None or self.closed:
+            return
+        self.text = text
+        if self.message is not None and self.flusher is None:
+            self.flusher = self.loop.create_task(self._flush())
+
+    def update_threadsafe(self, text):
+        # yt-dlp calls its hooks from the worker thread it runs in
+        self.loop.call_soon_threadsafe(self.update, text)
+
+    async def _flush(self):
+        try:
+            while self.text != self.sent_text:
+                await asyncio.sleep(max(0.0, self.last_edit + self.interval - time.monotonic()))
+                await self._edit()
+        finally:
+            self.flusher = None
+
+    async def _edit(self):
+        text = self.text
+        if self.message is None or text is None or text == self.sent_text:
+            return
+        self.sent_text = text
+        self.last_edit = time.monotonic()
+        try:
+            await self.message.edit(text)
+        except Exception as e:
+            print(f"Progress update skipped: {e}")
+
+    def close(self):
+        """
+        Drops any pending edit and ignores later updates, e.g. before the message is deleted.
+        """
+        self.closed = True
+        if self.flusher is not None:
+            self.flusher.cancel()
+            self.flusher = None
+
+    async def finish(self, text=None):
+        """
+        Shows text (or the latest state) right away, for final states the user must see.
+        """
+        self.close()
+        if text is not None:
+            self.text = text
+        await self._edit()
+
+    @staticmethod
+    def format_size(size):
+        for unit in ('B', 'KB', 'MB', 'GB'):
+            if size < 1024 or unit == 'GB':
+                return f"{size:.1f} {unit}" if unit != 'B' else f"{int(size)} B"
+            size /= 1024
+
+    @classmethod
+    def format_ytdlp(cls, status):
+        """
+        Turns a yt-dlp progress hook dict into one line of text, or None for states not worth showing.
+        """
+        if status.get('status') == 'finished':
+            return "Download finished, processing..."
+        if status.get('status') != 'downloading':
+            return None
+        downloaded = status.get('downloaded_bytes') or 0
+        total = status.get('total_bytes') or status.get('total_bytes_estimate')
+        if total:
+            text = f"Downloading: {downloaded / total:.0%} of {cls.format_size(total)}"
+        else:
+            text = f"Downloading: {cls.format_size(downloaded)}"
+        if status.get('speed'):
+            text += f" at {cls.format_size(status['speed'])}/s"
+        if status.get('eta') is not None:
+            text += f", {int(status['eta'])}s left"
+        return text
+
+    def ytdlp_progress_hook(self, status):
+        self.update_threadsafe(self.format_ytdlp(status))
+
+    def ytdlp_postprocessor_hook(self, status):
+        if status.get('status') == 'started':
+            self.update_threadsafe(f"Converting ({status.get('postprocessor', 'FFmpeg')})...")
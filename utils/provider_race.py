@@ -0,0 +1,115 @@
+import asyncio
+
+
+class ProviderRace:
+    """
+    Runs interchangeable providers for the same result with hedging instead of one after another.
+    The provider most likely to succeed starts first; the next one joins when the running ones
+    have made no progress for hedge_delay seconds after starting, or right away when one fails.
+    Time spent queued for a slot is not a stall, so no attempt is added while another is still queued,
+    but an attempt that has not started within queue_timeout seconds is given up on like a failure.
+    The first success wins and the others are cancelled. Success rates are learned per provider and
+    decide the order.
+    """
+
+    def __init__(self, providers, hedge_delay=20.0, queue_timeout=300.0):
+        self.providers = tuple(providers)
+        self.hedge_delay = hedge_delay
+        self.queue_timeout = queue_timeout
+        self.stats = {provider: {'attempts': 0, 'wins': 0, 'failures': 0, 'cancelled': 0}
+                      for provider in self.providers}
+
+    def success_rate(self, provider):
+        stats = self.stats[provider]
+        # Smoothed, so a provider is neither written off nor trusted after a single attempt
+        return (stats['wins'] + 1) / (stats['wins'] + stats['failures'] + 2)
+
+    def ranked(self):
+        # sorted() is stable, so equally good providers keep their configured order
+        return sorted(self.providers, key=self.success_rate, reverse=True)
+
+    async def run(self, attempt):
+        """
+        Calls attempt(provider, started, progressed) for as many providers as needed. attempt returns a truthy
+        result on success and a falsy one on failure, calls started() once it actually begins working and
+        progressed() whenever it advances. An attempt that never calls started() is never hedged,
+        and is given up on after queue_timeout.
+        Returns (provider, result) for the first success, or (None, None) when every provider failed.
+        """
+        loop = asyncio.get_running_loop()
+        pending = iter(self.ranked())
+        running = {}
+        # Launched attempts that have not started yet, with the time they were launched
+        queued = {}
+        last_progress = loop.time()
+
+        def progressed():
+            nonlocal last_progress
+            last_progress = loop.time()
+
+        def starter(provider):
+            def started():
+                if queued.pop(provider, None) is not None:
+                    progressed()
+            return started
+
+        def launch():
+            nonlocal last_progress
+            provider = next(pending, None)
+            if provider is None:
+                return False
+            self.stats[provider]['attempts'] += 1
+            queued[provider] = loop.time()
+            running[asyncio.create_task(attempt(provider, starter(provider), progressed))] = provider
+            last_progress = loop.time()
+            return True
+
+        launch()
+        try:
+            while running:
+                deadline = last_progress + self.hedge_delay
+                if queued:
+                    deadline = min(deadline, min(queued.values()) + self.queue_timeout)
+                done, _ = await asyncio.wait(running, timeout=max(0.0, deadline - loop.time()),
+                                             return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    expired = [task for task, provider in running.items()
+                               if provider in queued and queued[provider] + self.queue_timeout <= loop.time()]
+                    if expired:
+                        for task in expired:
+                            provider = running.pop(task)
+                            del queued[provider]
+                            task.cancel()
+                            self.stats[provider]['cancelled'] += 1
+                            print(f"Provider {provider} did not start within {self.queue_timeout}s")
+                        await asyncio.gather(*expired, return_exceptions=True)
+                        # Falls back to the next provider; the race fails once none are left
+                        for _ in expired:
+                            launch()
+                        continue
+                    if loop.time() < last_progress + self.hedge_delay:
+                        continue  # Progress was made while waiting
+                    # Everything started has stalled; hedge with the next provider unless one is still queued
+                    if queued or not launch():
+                        last_progress = loop.time()
+                    continue
+                for task in done:
+                    provider = running.pop(task)
+                    queued.pop(provider, None)
+                    try:
+                        result = task.result()
+                    except Exception as e:
+                        print(f"Provider {provider} failed: {e}")
+                        result = None
+                    if result:
+                        self.stats[provider]['wins'] += 1
+                        return provider, result
+                    self.stats[provider]['failures'] += 1
+                    launch()
+            return None, None
+        finally:
+            for task, provider in running.items():
+                task.cancel()
+                self.stats[provider]['cancelled'] += 1
+            # Lets the losers clean up (e.g. kill their subprocess) before the caller moves on
+            await asyncio.gather(*running, return_exceptions=True)
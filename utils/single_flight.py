@@ -0,0 +1,64 @@
+import asyncio
+
+
+class SingleFlight:
+    """
+    Registry of in-flight calls, keyed by what they produce.
+    While a call for a key is running, further calls for the same key wait for it and share
+    its result instead of repeating the work (and writing to the same file at the same time).
+    """
+
+    def __init__(self):
+        self.flights = {}
+        self.stats = {'started': 0, 'joined': 0}
+
+    def in_flight(self, key) -> bool:
+        return key in self.flights
+
+    def _finished(self, key, task):
+        if self.flights.get(key) is task:
+            del self.flights[key]
+        # Marks the exception as retrieved even when every waiter has gone away
+        if not task.cancelled():
+            task.exception()
+
+    async def run(self, key, func, *args, **kwargs):
+        """
+        Awaits func(*args, **kwargs), or the call already in flight for key. Its result or exception
+        is shared by every caller. The call runs as its own task, so a caller that gives up does not
+        cancel it for the others.
+        """
+        task = self.flights.get(key)
+        if task is None:
+            task = asyncio.ensure_future(func(*args, **kwargs))
+            self.flights[key] = task
+            task.add_done_callback(lambda finished: self._finished(key, finished))
+            self.stats['started'] += 1
+        else:
+            self.stats['joined'] += 1
+        return await asyncio.shield(task)
+
+    def claim(self, key):
+        """
+        Registers work for key that the caller carries out itself, e.g. across several pipeline stages, and
+        returns a future the caller must resolve with the result. Others join it as they would a run() call.
+        Returns None if a call for key is already in flight.
+        """
+        if key in self.flights:
+            return None
+        future = asyncio.get_running_loop().create_future()
+        self.flights[key] = future
+        future.add_done_callback(lambda finished: self._finished(key, finished))
+        self.stats['started'] += 1
+        return future
+
+    async def wait(self, key) -> bool:
+        """
+        Waits for the call in flight for key, whatever its outcome. Returns False if there was none.
+        """
+        task = self.flights.get(key)
+        if task is None:
+            return False
+        self.stats['joined'] += 1
+        await asyncio.wait([task])
+        return True
@@ -0,0 +1,188 @@
+import asyncio
+import itertools
+import json
+import os
+import sys
+
+
+class SpotdlService:
+    """
+    Client for the long-lived spotdl worker (spotdl_worker.py).
+    The worker pays spotdl's startup cost once and caps how many tracks download at the same time
+    across all users; jobs are sent to it over stdin and progress and results stream back on stdout.
+    It is started on the first job and restarted on the next one if it dies.
+    spotdl cannot interrupt a download in progress, so the worker is killed (failing the jobs it holds)
+    when a running job overruns job_timeout, or cancel_grace after its request gave up on it;
+    otherwise hung downloads would hold on to the worker's slots for good.
+    """
+
+    worker_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'spotdl_worker.py')
+    client_id = None
+    client_secret = None
+    max_concurrency = 4
+    job_timeout = 600
+    cancel_grace = 30
+    watch_interval = 5
+    work_directory = 'repository/Musics/.spotdl-worker'
+    process = None
+    reader = None
+    watchdog = None
+    ready = None
+    start_lock = None
+    jobs = {}
+    # Jobs the worker is running, with the time by which they must be done
+    running = {}
+    _job_ids = itertools.count(1)
+
+    @classmethod
+    def configure(cls, client_id, client_secret, max_concurrency=4, work_directory=None, job_timeout=None):
+        cls.client_id = client_id
+        cls.client_secret = client_secret
+        cls.max_concurrency = max(1, max_concurrency)
+        if job_timeout is not None:
+            cls.job_timeout = job_timeout
+        if work_directory is not None:
+            cls.work_directory = work_directory
+
+    @classmethod
+    async def _start(cls):
+        if cls.start_lock is None:
+            cls.start_lock = asyncio.Lock()
+        async with cls.start_lock:
+            if cls.process is not None and cls.process.returncode is None:
+                return await cls.ready
+            env = dict(os.environ, SPOTDL_MAX_CONCURRENCY=str(cls.max_concurrency),
+                       SPOTDL_WORK_DIRECTORY=cls.work_directory)
+            # Without credentials of its own the worker uses spotdl's defaults, like `python -m spotdl` does
+            if cls.client_id and cls.client_secret:
+                env.update(SPOTIFY_CLIENT_ID=cls.client_id, SPOTIFY_CLIENT_SECRET=cls.client_secret)
+            cls.process = await asyncio.create_subprocess_exec(
+                sys.executable, cls.worker_path,
+                stdin=asyncio.subprocess.PIPE,
+                stdout=asyncio.subprocess.PIPE,
+                env=env,
+                limit=1024 * 1024
+            )
+            cls.ready = asyncio.get_running_loop().create_future()
+            cls.reader = asyncio.create_task(cls._read(cls.process, cls.ready))
+            cls.watchdog = asyncio.create_task(cls._watch(cls.process))
+            return await cls.ready
+
+    @classmethod
+    async def _watch(cls, process):
+        loop = asyncio.get_running_loop()
+        while process.returncode is None:
+            await asyncio.sleep(cls.watch_interval)
+            overdue = [job_id for job_id, entry in cls.running.items()
+                       if entry['process'] is process and entry['deadline'] < loop.time()]
+            if overdue and process.returncode is None:
+                print(f"Utils: Restarting the spotdl worker, jobs {overdue} overran their deadline.")
+                process.kill()
+                return
+
+    @classmethod
+    async def _read(cls, process, ready):
+        reason = "The spotdl worker exited"
+        try:
+            while True:
+                line = await process.stdout.readline()
+                if not line:
+                    break
+                try:
+                    message = json.loads(line)
+                except ValueError:
+                    print(f"Utils: Ignoring unexpected spotdl worker output: {line.decode(errors='replace').strip()}")
+                    continue
+                event = message.get('event')
+                if event == 'ready':
+                    ready.set_result(True)
+                    print("Utils: SpotDL worker started.")
+                    continue
+                if event == 'fatal':
+                    reason = f"The spotdl worker failed to start: {message.get('message')}"
+                    print(reason)
+                    continue
+                job_id = message.get('id')
+                job = cls.jobs.get(job_id)
+                if event == 'started':
+                    # A job given up on while it was queued still runs until the worker notices
+                    timeout = cls.job_timeout if job is not None else cls.cancel_grace
+                    cls.running[job_id] = {'process': process,
+                                           'deadline': asyncio.get_running_loop().time() + timeout}
+                    if job is not None and job['on_started'] is not None:
+                        job['on_started']()
+                    continue
+                if event in ('done', 'error', 'cancelled'):
+                    cls.running.pop(job_id, None)
+                if job is None:
+                    continue
+                if event == 'progress':
+                    if job['on_progress'] is not None:
+                        job['on_progress'](message.get('status'), message.get('percent'))
+                elif event == 'done':
+                    job['future'].set_result(message['path'])
+                elif event == 'error':
+                    job['future'].set_exception(RuntimeError(message.get('message')))
+        except Exception as e:
+            reason = f"Lost the spotdl worker: {e}"
+        finally:
+            # A worker we stopped listening to could block on a full pipe, so it is not left running
+            if process.returncode is None:
+                process.kill()
+            await process.wait()
+            for job_id, entry in list(cls.running.items()):
+                if entry['process'] is process:
+                    del cls.running[job_id]
+            if not ready.done():
+                ready.set_exception(RuntimeError(reason))
+            # Jobs still waiting will never hear back; the next job starts a new worker
+            for job in list(cls.jobs.values()):
+                if job['process'] is process and not job['future'].done():
+                    job['future'].set_exception(RuntimeError(reason))
+
+    @classmethod
+    def _send(cls, message):
+        cls.process.stdin.write((json.dumps(message) + "\n").encode())
+
+    @classmethod
+    async def download(cls, url, format, audio, output_directory, on_progress=None, on_started=None):
+        """
+        Downloads the track at url with one audio provider into output_directory and returns the file's path.
+        on_started() is called once the worker takes the job off its queue, and on_progress(status, percent)
+        as it reports progress. Raises RuntimeError on failure.
+        """
+        await cls._start()
+        job_id = next(cls._job_ids)
+        future = asyncio.get_running_loop().create_future()
+        cls.jobs[job_id] = {'future': future, 'on_progress': on_progress, 'on_started': on_started,
+                            'process': cls.process}
+        try:
+            cls._send({'id': job_id, 'url': url, 'format': format, 'audio': audio,
+                       'output_directory': os.path.abspath(output_directory)})
+            await cls.process.stdin.drain()
+            return await future
+        except asyncio.CancelledError:
+            if cls.process is not None and cls.process.returncode is None:
+                cls._send({'cancel': job_id})
+            entry = cls.running.get(job_id)
+            if entry is not None:
+                entry['deadline'] = min(entry['deadline'], asyncio.get_running_loop().time() + cls.cancel_grace)
+            raise
+        finally:
+            cls.jobs.pop(job_id, None)
+
+    @classmethod
+    async def stop(cls):
+        if cls.process is None or cls.process.returncode is not None:
+            return
+        # Closing stdin tells the worker there is nothing more to do
+        cls.process.stdin.close()
+        try:
+            await asyncio.wait_for(cls.process.wait(), timeout=10)
+        except asyncio.TimeoutError:
+            cls.process.kill()
+        if cls.reader is not None:
+            await cls.reader
+        if cls.watchdog is not None:
+            cls.watchdog.cancel()
+        cls.process = None
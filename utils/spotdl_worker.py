@@ -0,0 +1,159 @@
+"""
+Long-lived spotdl worker, started by SpotdlService.
+
+spotdl is imported and its Spotify client initialized once; track jobs then arrive as JSON lines on stdin:
+    {"id": 1, "url": "...", "format": "mp3", "audio": "piped", "output_directory": "..."}
+    {"cancel": 1}
+and progress and results go back as JSON lines on stdout:
+    {"event": "ready"}
+    {"id": 1, "event": "started"}
+    {"id": 1, "event": "progress", "status": "Downloading", "percent": 40}
+    {"id": 1, "event": "done", "path": "..."}
+    {"id": 1, "event": "error", "message": "..."}
+    {"id": 1, "event": "cancelled"}
+At most SPOTDL_MAX_CONCURRENCY tracks download at the same time, whoever asked for them;
+"started" tells a job apart from the ones still queued behind them.
+This file is run as a script and must not import the bot's own packages.
+"""
+import asyncio
+import json
+import os
+import shutil
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# stdout carries the protocol; anything spotdl prints goes to stderr instead
+protocol = os.fdopen(os.dup(sys.stdout.fileno()), 'w', buffering=1)
+os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+protocol_lock = threading.Lock()
+
+
+def send(**message):
+    with protocol_lock:
+        protocol.write(json.dumps(message) + "\n")
+
+
+class Worker:
+
+    def __init__(self, work_directory, max_concurrency):
+        from spotdl.utils.config import DEFAULT_CONFIG
+        from spotdl.utils.spotify import SpotifyClient
+        SpotifyClient.init(client_id=os.environ.get("SPOTIFY_CLIENT_ID") or DEFAULT_CONFIG["client_id"],
+                           client_secret=os.environ.get("SPOTIFY_CLIENT_SECRET") or DEFAULT_CONFIG["client_secret"],
+                           no_cache=True)
+
+        self.work_directory = work_directory
+        self.executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix='spotdl')
+        self.downloaders = {}
+        self.downloaders_lock = threading.Lock()
+        # Jobs for the same song and provider share an output file, so they take turns
+        self.song_locks = {}
+        self.futures = {}
+        self.cancelled = set()
+        self.tracked_jobs = {}
+
+    def get_downloader(self, format, audio):
+        from spotdl.download.downloader import Downloader
+        with self.downloaders_lock:
+            downloader = self.downloaders.get((format, audio))
+            if downloader is None:
+                downloader = Downloader(settings={
+                    "audio_providers": [audio],
+                    "format": format,
+                    "output": os.path.join(self.work_directory, audio, "{track-id}.{output-ext}"),
+                    "overwrite": "force",
+                    "threads": 1,
+                    "simple_tui": True,
+                }, loop=asyncio.new_event_loop())
+                self.track_progress(downloader, audio)
+                self.downloaders[(format, audio)] = downloader
+            return downloader
+
+    def track_progress(self, downloader, audio):
+        def on_update(tracker, message):
+            job_id = self.tracked_jobs.get((audio, tracker.song.song_id))
+            if job_id is not None:
+                send(id=job_id, event="progress", status=message, percent=int(getattr(tracker, 'progress', 0)))
+
+        progress_handler = getattr(downloader, 'progress_handler', None)
+        if progress_handler is not None:
+            progress_handler.update_callback = on_update
+
+    def download(self, job):
+        from spotdl.types.song import Song
+        job_id = job["id"]
+        if job_id in self.cancelled:
+            return
+        song = Song.from_url(job["url"])
+        key = (job["audio"], song.song_id)
+        with self.song_locks.setdefault(key, threading.Lock()):
+            if job_id in self.cancelled:
+                return
+            self.tracked_jobs[key] = job_id
+            try:
+                _, path = self.get_downloader(job["format"], job["audio"]).search_and_download(song)
+            finally:
+                self.tracked_jobs.pop(key, None)
+            if path is None or not os.path.isfile(path):
+                raise LookupError(f"No {job['audio']} result for {job['url']}")
+            if job_id in self.cancelled:
+                os.remove(path)
+                return
+            os.makedirs(job["output_directory"], exist_ok=True)
+            return shutil.move(str(path), os.path.join(job["output_directory"], os.path.basename(path)))
+
+    def run_job(self, job):
+        send(id=job["id"], event="started")
+        try:
+            path = self.download(job)
+            if path is not None:
+                send(id=job["id"], event="done", path=path)
+            else:
+                send(id=job["id"], event="cancelled")
+        except Exception as e:
+            send(id=job["id"], event="error", message=f"{type(e).__name__}: {e}")
+        finally:
+            self.futures.pop(job["id"], None)
+            self.cancelled.discard(job["id"])
+
+    def submit(self, job):
+        self.futures[job["id"]] = self.executor.submit(self.run_job, job)
+
+    def cancel(self, job_id):
+        future = self.futures.get(job_id)
+        if future is None:
+            return
+        # A job that has not started yet is dropped; a running one cannot be interrupted, so it finishes and its
+        # file is discarded (SpotdlService restarts the worker if that takes too long)
+        if future.cancel():
+            self.futures.pop(job_id, None)
+        else:
+            self.cancelled.add(job_id)
+
+    def serve(self, lines):
+        for line in lines:
+            if not line.strip():
+                continue
+            message = json.loads(line)
+            if "cancel" in message:
+                self.cancel(message["cancel"])
+            else:
+                self.submit(message)
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+def main():
+    try:
+        worker = Worker(os.environ.get("SPOTDL_WORK_DIRECTORY", "repository/Musics/.spotdl-worker"),
+                        int(os.environ.get("SPOTDL_MAX_CONCURRENCY", 4)))
+    except Exception as e:
+        send(event="fatal", message=f"{type(e).__name__}: {e}")
+        return 1
+    send(event="ready")
+    worker.serve(sys.stdin)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,56 @@
+import inspect
+import time
+from .cache import TTLCache
+from .database import db
+
+
+class SpotifyCache:
+    """
+    Two-tier read-through cache for Spotify Web API objects: an in-memory LRU in front of the
+    spotify_objects table. Lifetimes are per object type, since playlists change far more often than tracks.
+    """
+
+    ttls = {
+        'track': 7 * 24 * 3600,
+        'album': 7 * 24 * 3600,
+        'artist': 24 * 3600,
+        'playlist': 3600,
+        'short_link': 30 * 24 * 3600,
+    }
+    memory = TTLCache(maxsize=4096)
+
+    @staticmethod
+    async def get(object_type, object_id, fetch):
+        """
+        Returns the cached object, or calls fetch(object_id) and stores its result in both tiers.
+        fetch may be a plain function or a coroutine function.
+        """
+        key = (object_type, object_id)
+        data = SpotifyCache.memory.get(key)
+        if data is not None:
+            return data
+
+        stored = await db.get_spotify_object(object_type, object_id)
+        if stored is not None:
+            data, fetched_at = stored
+            remaining = fetched_at + SpotifyCache.ttls[object_type] - time.time()
+            if remaining > 0:
+                SpotifyCache.memory.put(key, data, ttl=remaining)
+                return data
+
+        data = fetch(object_id)
+        if inspect.isawaitable(data):
+            data = await data
+        await SpotifyCache.put(object_type, object_id, data)
+        return data
+
+    @staticmethod
+    async def put(object_type, object_id, data):
+        if data is None:
+            return
+        SpotifyCache.memory.put((object_type, object_id), data, ttl=SpotifyCache.ttls[object_type])
+        await db.set_spotify_object(object_type, object_id, data)
+
+    @staticmethod
+    def is_cached(object_type, object_id):
+        return SpotifyCache.memory.get((object_type, object_id)) is not None
@@ -0,0 +1,141 @@
+import asyncio
+import os
+import time
+import aiohttp
+from spotipy.exceptions import SpotifyException
+from spotipy.oauth2 import SpotifyOauthError
+
+
+class AsyncSpotify:
+    """
+    Non-blocking client for the Spotify Web API endpoints the bot uses.
+    Method names and arguments follow spotipy.Spotify, so callers only need to add `await`.
+    One keep-alive session is shared by all requests, and the client-credentials token is renewed
+    shortly before it expires instead of after a request fails.
+    """
+
+    api_url = 'https://api.spotify.com/v1/'
+    token_url = 'https://accounts.spotify.com/api/token'
+    # Renew the token this many seconds before Spotify would reject it
+    token_refresh_margin = 300
+    max_retries = 3
+
+    def __init__(self, client_id=None, client_secret=None, max_connections=20, timeout=15):
+        # Like spotipy, missing credentials are taken from the SPOTIPY_* environment variables
+        self.client_id = client_id or os.getenv('SPOTIPY_CLIENT_ID')
+        self.client_secret = client_secret or os.getenv('SPOTIPY_CLIENT_SECRET')
+        if not self.client_id:
+            raise SpotifyOauthError("No client_id. Pass it or set a SPOTIPY_CLIENT_ID environment variable.")
+        if not self.client_secret:
+            raise SpotifyOauthError("No client_secret. Pass it or set a SPOTIPY_CLIENT_SECRET environment variable.")
+        self.max_connections = max_connections
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        self.session = None
+        self.token = None
+        self.token_expires_at = 0.0
+        self.token_lock = asyncio.Lock()
+
+    def _get_session(self):
+        if self.session is None or self.session.closed:
+            connector = aiohttp.TCPConnector(limit=self.max_connections, keepalive_timeout=60)
+            self.session = aiohttp.ClientSession(connector=connector, timeout=self.timeout)
+        return self.session
+
+    async def close(self):
+        if self.session is not None and not self.session.closed:
+            await self.session.close()
+        self.session = None
+
+    async def _get_token(self, force=False):
+        if not force and self.token and time.time() < self.token_expires_at - self.token_refresh_margin:
+            return self.token
+        async with self.token_lock:
+            # Another request may have renewed it while this one waited for the lock
+            if not force and self.token and time.time() < self.token_expires_at - self.token_refresh_margin:
+                return self.token
+            async with self._get_session().post(self.token_url, data={'grant_type': 'client_credentials'},
+                                                auth=aiohttp.BasicAuth(self.client_id, self.client_secret)) as response:
+                payload = await response.json(content_type=None)
+                if response.status != 200:
+                    raise SpotifyException(response.status, -1, f"{self.token_url}: {payload}")
+            self.token = payload['access_token']
+            self.token_expires_at = time.time() + payload.get('expires_in', 3600)
+            return self.token
+
+    async def _get(self, path, **params):
+        url = path if path.startswith('https://') else self.api_url + path
+        params = {key: value for key, value in params.items() if value is not None}
+        force_token = False
+        for attempt in range(self.max_retries + 1):
+            token = await self._get_token(force=force_token)
+            force_token = False
+            async with self._get_session().get(url, params=params,
+                                               headers={'Authorization': f'Bearer {token}'}) as response:
+                if response.status == 200:
+                    return await response.json(content_type=None)
+                if attempt < self.max_retries:
+                    if response.status == 401:
+                        force_token = True
+                        continue
+                    if response.status == 429:
+                        await asyncio.sleep(int(response.headers.get('Retry-After', 1)))
+                        continue
+                    if response.status >= 500:
+                        await asyncio.sleep(0.5 * 2 ** attempt)
+                        continue
+                try:
+                    message = (await response.json(content_type=None))['error']['message']
+                except Exception:
+                    message = await response.text()
+                raise SpotifyException(response.status, -1, f"{url}:\n {message}", headers=response.headers)
+
+    @staticmethod
+    def _get_id(object_type, value):
+        # Accepts a bare id, a spotify:<type>:<id> URI or an open.spotify.com URL, like spotipy does
+        if value.startswith('spotify:'):
+            return value.split(':')[-1]
+        if f'/{object_type}/' in value:
+            return value.split(f'/{object_type}/')[-1].split('?')[0].rstrip('/')
+        return value
+
+    @staticmethod
+    def _join(values):
+        return ','.join(values) if not isinstance(values, str) else values
+
+    async def search(self, q, limit=10, offset=0, type='track', market=None):
+        return await self._get('search', q=q, limit=limit, offset=offset, type=type, market=market)
+
+    async def track(self, track_id, market=None):
+        return await self._get(f"tracks/{self._get_id('track', track_id)}", market=market)
+
+    async def tracks(self, tracks, market=None):
+        ids = [self._get_id('track', track_id) for track_id in tracks]
+        return await self._get('tracks', ids=self._join(ids), market=market)
+
+    async def artist(self, artist_id):
+        return await self._get(f"artists/{self._get_id('artist', artist_id)}")
+
+    async def artists(self, artists):
+        ids = [self._get_id('artist', artist_id) for artist_id in artists]
+        return await self._get('artists', ids=self._join(ids))
+
+    async def album(self, album_id, market=None):
+        return await self._get(f"albums/{self._get_id('album', album_id)}", market=market)
+
+    async def playlist(self, playlist_id, fields=None, market=None, additional_types=('track',)):
+        return await self._get(f"playlists/{self._get_id('playlist', playlist_id)}", fields=fields,
+                               market=market, additional_types=self._join(additional_types))
+
+    async def playlist_items(self, playlist_id, fields=None, limit=100, offset=0, market=None,
+                             additional_types=('track', 'episode')):
+        return await self._get(f"playlists/{self._get_id('playlist', playlist_id)}/tracks", fields=fields,
+                               limit=limit, offset=offset, market=market,
+                               additional_types=self._join(additional_types))
+
+    async def next(self, result):
+        """
+        Returns the next page of a paged result, or None on the last page.
+        """
+        if result.get('next'):
+            return await self._get(result['next'])
+        return None
@@ -0,0 +1,80 @@
+import asyncio
+import hashlib
+import os
+from io import BytesIO
+import aiohttp
+from PIL import Image
+from .single_flight import SingleFlight
+
+
+class Thumbnails:
+    """
+    Cover art stored once per image URL, already in Telegram's thumbnail format:
+    a JPEG of at most 320px per side. Every track of an album shares one file, which serves
+    both as the track card photo and as the thumbnail of the audio upload.
+    """
+
+    directory = 'repository/Icons'
+    size = 320
+    jpeg_quality = 85
+    session = None
+    fetches = SingleFlight()
+
+    @classmethod
+    def configure(cls, directory):
+        cls.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    @classmethod
+    def _get_session(cls):
+        if cls.session is None or cls.session.closed:
+            cls.session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=20))
+        return cls.session
+
+    @classmethod
+    async def close(cls):
+        if cls.session is not None and not cls.session.closed:
+            await cls.session.close()
+        cls.session = None
+
+    @classmethod
+    def path_for(cls, image_url):
+        url_hash = hashlib.blake2b(image_url.encode(), digest_size=16).hexdigest()
+        return os.path.join(cls.directory, f"{url_hash}.jpg")
+
+    @classmethod
+    def _convert(cls, image_data, path):
+        with Image.open(BytesIO(image_data)) as image:
+            # Lets the JPEG decoder downscale while decoding instead of decoding the full image first
+            image.draft('RGB', (cls.size, cls.size))
+            image = image.convert('RGB')
+            image.thumbnail((cls.size, cls.size))
+            temporary_path = f"{path}.part"
+            image.save(temporary_path, 'JPEG', quality=cls.jpeg_quality, optimize=True)
+        os.replace(temporary_path, path)
+
+    @classmethod
+    async def _fetch(cls, image_url, path):
+        try:
+            async with cls._get_session().get(image_url) as response:
+                if response.status != 200:
+                    print(f"Failed to download image {image_url}. Status code: {response.status}")
+                    return None
+                image_data = await response.read()
+            await asyncio.to_thread(cls._convert, image_data, path)
+            return path
+        except Exception as e:
+            print(f"Failed to download or save image {image_url}: {e}")
+            return None
+
+    @classmethod
+    async def get(cls, image_url):
+        """
+        Returns the path of the thumbnail for image_url, fetching it first if needed, or None on failure.
+        """
+        if not image_url:
+            return None
+        path = cls.path_for(image_url)
+        if os.path.isfile(path):
+            return path
+        return await cls.fetches.run(path, cls._fetch, image_url, path)
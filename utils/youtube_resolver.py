@@ -0,0 +1,216 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from yt_dlp import YoutubeDL
+from .cache import TTLCache
+from .database import db
+from .helper import run_in_background
+
+
+class YoutubeResolver:
+    """
+    Process-wide Spotify to YouTube matcher.
+    Every search runs on one bounded executor; the first acceptable match cancels the searches that
+    are still queued, and results of the ones already running are discarded.
+    Matches are remembered per Spotify track id (falling back to ISRC) in memory and in youtube_matches,
+    so popular tracks are only searched again when their match is due for revalidation.
+    """
+
+    max_workers = 4
+    results_per_query = 3
+    max_duration_diff = 35
+    executor = None
+    query_stats = {}
+    match_ttl = 30 * 24 * 3600
+    no_match_ttl = 24 * 3600
+    matches = TTLCache(maxsize=4096)
+    revalidating = set()
+    lookups = {'memory': 0, 'stored': 0, 'searched': 0}
+
+    ydl_opts = {
+        'quiet': True,
+        'no_warnings': True,
+        'ignoreerrors': True,
+        'skip_download': True,
+        # Search pages already carry id and duration, so the individual videos are not extracted
+        'extract_flat': 'in_playlist',
+        'noplaylist': True,
+        'nocheckcertificate': True,
+        'cachedir': False
+    }
+
+    @classmethod
+    def get_executor(cls):
+        if cls.executor is None:
+            cls.executor = ThreadPoolExecutor(max_workers=cls.max_workers, thread_name_prefix='yt-resolver')
+        return cls.executor
+
+    @classmethod
+    def shutdown(cls):
+        if cls.executor is not None:
+            cls.executor.shutdown(wait=False, cancel_futures=True)
+            cls.executor = None
+
+    @staticmethod
+    def build_queries(link_info):
+        artist_name = link_info["artist_name"]
+        track_name = link_info["track_name"]
+        release_year = link_info["release_year"]
+        album_name = link_info.get("album_name", "")
+        return [
+            ('lyrics', f'"{artist_name}" "{track_name}" lyrics {release_year}'),
+            ('by_artist', f'"{track_name}" by "{artist_name}" {release_year}'),
+            ('album', f'"{artist_name}" "{track_name}" "{album_name}" {release_year}'),
+        ]
+
+    @classmethod
+    def _record(cls, name, started, outcome):
+        stats = cls.query_stats.setdefault(name, {'runs': 0, 'matches': 0, 'misses': 0, 'cancelled': 0,
+                                                  'errors': 0, 'total_ms': 0.0, 'max_ms': 0.0})
+        elapsed_ms = (time.monotonic() - started) * 1000
+        stats['runs'] += 1
+        stats[outcome] += 1
+        stats['total_ms'] += elapsed_ms
+        stats['max_ms'] = max(stats['max_ms'], elapsed_ms)
+
+    @classmethod
+    def stats(cls):
+        """
+        Per-query-kind counters and latencies, in the same shape as the other stats() helpers.
+        """
+        return {name: dict(stats, avg_ms=stats['total_ms'] / stats['runs'] if stats['runs'] else 0.0)
+                for name, stats in cls.query_stats.items()}
+
+    @classmethod
+    def _search_blocking(cls, query, cancelled):
+        # A search that lost the race while still queued never reaches YouTube
+        if cancelled.is_set():
+            return None
+        with YoutubeDL(cls.ydl_opts) as ydl:
+            info = ydl.extract_info(f'ytsearch{cls.results_per_query}:{query}', download=False)
+        if info is None:
+            # ignoreerrors turns failures into None; report them so they are not mistaken for "no match"
+            raise RuntimeError(f"YouTube search failed for {query!r}")
+        return info.get('entries') or []
+
+    @classmethod
+    async def _search(cls, name, query, track_duration, cancelled):
+        started = time.monotonic()
+        try:
+            entries = await asyncio.get_running_loop().run_in_executor(
+                cls.get_executor(), cls._search_blocking, query, cancelled)
+        except asyncio.CancelledError:
+            cls._record(name, started, 'cancelled')
+            raise
+        except Exception:
+            cls._record(name, started, 'errors')
+            raise
+
+        if entries is None:
+            cls._record(name, started, 'cancelled')
+            return None
+
+        for rank, video_info in enumerate(entries):
+            if not video_info or video_info.get('duration') is None:
+                continue
+            # Compare the video duration with the track duration from Spotify
+            duration_delta = abs(video_info['duration'] - track_duration)
+            if duration_delta <= cls.max_duration_diff:
+                cls._record(name, started, 'matches')
+                video_url = video_info.get('webpage_url') or video_info.get('url') or \
+                    f"https://www.youtube.com/watch?v={video_info['id']}"
+                # Closer durations and higher-ranked results are more likely to be the right recording
+                confidence = (1 - duration_delta / (cls.max_duration_diff + 1)) * (1 - 0.1 * rank)
+                return {'video_url': video_url, 'duration_delta': duration_delta, 'confidence': round(confidence, 3)}
+
+        cls._record(name, started, 'misses')
+        return None
+
+    @classmethod
+    async def resolve(cls, link_info):
+        """
+        Searches YouTube and returns the first result whose duration is close to the track's as
+        {'video_url', 'duration_delta', 'confidence'}, or None. Raises if every search failed.
+        """
+        track_duration = link_info.get("duration_ms", 0) / 1000
+        cancelled = threading.Event()
+        tasks = [asyncio.create_task(cls._search(name, query, track_duration, cancelled))
+                 for name, query in cls.build_queries(link_info)]
+        last_error = None
+        completed = 0
+        try:
+            for next_result in asyncio.as_completed(tasks):
+                try:
+                    match = await next_result
+                except Exception as e:
+                    last_error = e
+                    continue
+                completed += 1
+                if match is not None:
+                    return match
+            if not completed and last_error is not None:
+                raise last_error
+            return None
+        finally:
+            cancelled.set()
+            for task in tasks:
+                task.cancel()
+
+    @classmethod
+    def _is_stale(cls, match):
+        ttl = cls.match_ttl if match['video_url'] else cls.no_match_ttl
+        return match['checked_at'] + ttl <= time.time()
+
+    @classmethod
+    async def _refresh(cls, link_info):
+        track_id = link_info['track_id']
+        try:
+            match = await cls.resolve(link_info)
+        except Exception as e:
+            # Searches that failed outright say nothing about the track, so nothing is cached
+            print(f"YouTube match search failed for {track_id}: {e}")
+            return None
+        match = dict(match or {'video_url': None, 'duration_delta': None, 'confidence': None}, checked_at=time.time())
+        cls.matches.set(track_id, match)
+        await db.set_youtube_match(track_id, link_info.get('isrc'), match['video_url'], match['duration_delta'],
+                                   match['confidence'])
+        return match
+
+    @classmethod
+    async def _revalidate(cls, link_info):
+        try:
+            await cls._refresh(link_info)
+        finally:
+            cls.revalidating.discard(link_info['track_id'])
+
+    @classmethod
+    async def find_video_url(cls, link_info):
+        """
+        Returns the YouTube URL matched to a Spotify track, or None when it has no acceptable match.
+        Stale matches are served as they are and revalidated in the background.
+        """
+        track_id = link_info.get('track_id')
+        if track_id is None:
+            match = await cls.resolve(link_info)
+            return match['video_url'] if match else None
+
+        match = cls.matches.get(track_id)
+        if match is not None:
+            cls.lookups['memory'] += 1
+        else:
+            generation = cls.matches.generation
+            match = await db.get_youtube_match(track_id, link_info.get('isrc'))
+            if match is not None:
+                cls.lookups['stored'] += 1
+                cls.matches.put(track_id, match, generation)
+
+        if match is None or (match['video_url'] is None and cls._is_stale(match)):
+            cls.lookups['searched'] += 1
+            match = await cls._refresh(link_info)
+            return match['video_url'] if match else None
+
+        if cls._is_stale(match) and track_id not in cls.revalidating:
+            cls.revalidating.add(track_id)
+            run_in_background(cls._revalidate(link_info), name=f"revalidate {track_id}")
+        return match['video_url']